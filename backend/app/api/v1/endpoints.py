@@ -1,98 +1,673 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy import delete, select, true, tuple_
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import undefer
+import asyncio
+import logging
+import base64
+import hashlib
+import os
 import uuid
-from typing import List
-from datetime import datetime, timedelta
+from typing import AsyncIterator, List, Optional, Tuple
+from datetime import datetime
 
 from ... import schemas, models
-from ...database import get_db
-from ...services.email_service import generate_temp_email
+from ...core.config import settings
+from ...database import get_async_db, AsyncSessionLocal
+from ...services.email_service import generate_temp_email, generate_temp_emails, calculate_expiry
+from ...services.address_index import get_address_index
+from ...services.blob_store import get_blob_store, release_blobs
+from ...services.mailbox_pool import get_mailbox_pool
+from ...services.notification_bus import get_notification_bus
+from ...services.parser_pool import get_parser_pool
+from ...services.raw_archive import iter_raw, render_message
+from ...services.reaper import get_reaper
+from ...services.search import search_condition
+from .responses import RangeFileResponse
+from .websocket import manager as ws_manager
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+async def invalidate_address(email_address: str):
+    """Сбросить адрес в кэше SMTP сервера, даже если он работает в другом процессе"""
+    # Публикация в Postgres блокирует - выполняем её в пуле потоков
+    await run_in_threadpool(
+        get_notification_bus().publish, [{"type": "address_invalidated", "email": email_address}]
+    )
+
 @router.post("/email", response_model=schemas.EmailAccount)
-def create_temp_email_account(db: Session = Depends(get_db)):
+async def create_temp_email_account(db: AsyncSession = Depends(get_async_db)):
     """
     Создать новый временный почтовый ящик
     """
-    # Генерируем уникальный email
-    email_address = generate_temp_email()
+    # Быстрый путь: готовый ящик из пула (срок действия назначается при выдаче)
+    pool = get_mailbox_pool()
+    db_account = await pool.claim(db) if pool.enabled else None
     
-    # Рассчитываем срок истечения (например, +24 часа)
-    expires_at = datetime.utcnow() + timedelta(hours=24)
+    if db_account is None:
+        # Генерируем уникальный email
+        email_address = generate_temp_email()
+        
+        # Рассчитываем срок истечения (EMAIL_TTL_HOURS)
+        expires_at = calculate_expiry()
+        
+        # Создаём запись в БД
+        db_account = models.EmailAccount(
+            email=email_address,
+            expires_at=expires_at  # <-- Добавляем expires_at
+        )
+        
+        db.add(db_account)
+        await db.commit()
+        await db.refresh(db_account)
     
-    # Создаём запись в БД
-    db_account = models.EmailAccount(
-        email=email_address,
-        expires_at=expires_at  # <-- Добавляем expires_at
-    )
-    
-    db.add(db_account)
-    db.commit()
-    db.refresh(db_account)
+    # Адрес мог попасть в отрицательный кэш SMTP сервера
+    await invalidate_address(db_account.email)
     
     return db_account
 
+# Сколько раз перегенерировать адреса, совпавшие с существующими
+BATCH_MAX_ATTEMPTS = 5
+
+async def provision_accounts(count: int) -> AsyncIterator[bytes]:
+    """
+    Создать count ящиков порциями по EMAIL_BATCH_CHUNK_SIZE и отдавать их
+    по мере фиксации - по одной JSON строке на ящик (NDJSON).
+
+    Каждая порция - один многострочный INSERT ... ON CONFLICT DO NOTHING
+    RETURNING; заново генерируются только адреса, совпавшие с уже
+    существующими. Сброс кэша адресов SMTP сервера не нужен: случайный
+    адрес не мог попасть в отрицательный кэш до создания ящика.
+    """
+    expires_at = calculate_expiry()
+    remaining = count
+    while remaining > 0:
+        pending = min(remaining, settings.EMAIL_BATCH_CHUNK_SIZE)
+        lines = []
+        for _ in range(BATCH_MAX_ATTEMPTS):
+            rows = [
+                {"id": uuid.uuid4(), "email": email, "expires_at": expires_at, "is_active": True}
+                for email in generate_temp_emails(pending)
+            ]
+            # Короткая сессия на порцию: соединение не держится, пока клиент читает ответ
+            async with AsyncSessionLocal() as db:
+                created = (await db.execute(
+                    insert(models.EmailAccount)
+                    .values(rows)
+                    .on_conflict_do_nothing(index_elements=[models.EmailAccount.email])
+                    .returning(models.EmailAccount)
+                )).scalars().all()
+                await db.commit()
+            lines.extend(schemas.EmailAccount.model_validate(account).model_dump_json() for account in created)
+            pending -= len(created)
+            if pending <= 0:
+                break
+        else:
+            logger.error(f"Не удалось подобрать свободные адреса для {pending} ящиков")
+            raise RuntimeError("Address collisions exhausted retries")
+        remaining -= len(lines)
+        yield ("\n".join(lines) + "\n").encode()
+
+@router.post(
+    "/email/batch",
+    response_class=StreamingResponse,
+    responses={200: {"content": {"application/x-ndjson": {}}, "description": "Созданные ящики, по одному JSON на строку"}}
+)
+async def create_temp_email_accounts(count: int = Query(..., ge=1, le=settings.EMAIL_BATCH_MAX_COUNT)):
+    """
+    Создать много временных ящиков за один запрос (для нагрузочных тестов).
+
+    Ящики возвращаются потоком NDJSON в формате POST /email по мере создания.
+    """
+    return StreamingResponse(provision_accounts(count), media_type="application/x-ndjson")
+
 @router.get("/email/{email_id}", response_model=schemas.EmailAccount)
-def get_email_account(email_id: uuid.UUID, db: Session = Depends(get_db)):
+async def get_email_account(email_id: uuid.UUID, db: AsyncSession = Depends(get_async_db)):
     """
     Получить информацию о почтовом ящике
     """
-    account = db.query(models.EmailAccount).filter(models.EmailAccount.id == email_id).first()
-    if not account:
+    account = await db.get(models.EmailAccount, email_id)
+    # Ящик пула ещё никому не выдан - для клиентов его нет
+    if not account or account.pooled:
         raise HTTPException(status_code=404, detail="Email account not found")
     return account
 
 @router.delete("/email/{email_id}")
-def delete_email_account(email_id: uuid.UUID, db: Session = Depends(get_db)):
+async def delete_email_account(email_id: uuid.UUID, db: AsyncSession = Depends(get_async_db)):
     """
     Удалить почтовый ящик и все связанные письма
     """
-    account = db.query(models.EmailAccount).filter(models.EmailAccount.id == email_id).first()
-    if not account:
+    account = await db.get(models.EmailAccount, email_id)
+    if not account or account.pooled:
         raise HTTPException(status_code=404, detail="Email account not found")
     
-    # Удаляем все сообщения
-    db.query(models.EmailMessage).filter(models.EmailMessage.email_account_id == email_id).delete()
+    # Удаляем вложения и все сообщения
+    hashes = (await db.execute(
+        delete(models.EmailAttachment)
+        .where(models.EmailAttachment.email_account_id == email_id)
+        .returning(models.EmailAttachment.sha256)
+    )).scalars().all()
+    await db.execute(delete(models.EmailMessage).where(models.EmailMessage.email_account_id == email_id))
     
     # Удаляем аккаунт
-    db.delete(account)
-    db.commit()
+    email_address = account.email
+    await db.delete(account)
+    await db.commit()
+    
+    await invalidate_address(email_address)
+    if hashes:
+        await run_in_threadpool(release_blobs, hashes)
     
     return {"message": "Email account deleted successfully"}
 
+# Поля письма, которые можно запросить через fields=
+MESSAGE_FIELDS = {
+    "id": models.EmailMessage.id,
+    "email_account_id": models.EmailMessage.email_account_id,
+    "sender": models.EmailMessage.sender,
+    "recipient": models.EmailMessage.recipient,
+    "subject": models.EmailMessage.subject,
+    "body_text": models.EmailMessage.body_text,
+    "body_html": models.EmailMessage.body_html,
+    "received_at": models.EmailMessage.received_at,
+    "seq": models.EmailMessage.seq,
+    "otp_code": models.EmailMessage.otp_code,
+    "confirm_link": models.EmailMessage.confirm_link,
+}
+
+def mailbox_etag(email_id: uuid.UUID, version: int, **params) -> str:
+    """
+    ETag ответа со списком писем ящика: меняется с каждым новым письмом
+    и различается для разных параметров запроса (limit, after, since, fields) -
+    иначе 304 на одну страницу подошёл бы к кэшу другой.
+    """
+    query = "&".join(f"{name}={params[name]}" for name in sorted(params) if params[name] is not None)
+    digest = hashlib.sha1(query.encode()).hexdigest()[:16]
+    return f'W/"{email_id}-{version}-{digest}"'
+
+def fields_key(fields: Optional[str], field_names: List[str]) -> Optional[str]:
+    """Нормализованный fields для ETag: порядок и повторы полей не меняют ответ по существу"""
+    return None if fields is None else ",".join(sorted(set(field_names)))
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """Проверка заголовка If-None-Match условного GET"""
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    return if_none_match.strip() == "*" or etag in [tag.strip() for tag in if_none_match.split(",")]
+
+async def get_mailbox_version(db: AsyncSession, email_id: uuid.UUID) -> int:
+    """Версия ящика по первичному ключу, без обращения к письмам"""
+    version = (await db.execute(
+        select(models.EmailAccount.message_version).where(models.EmailAccount.id == email_id)
+    )).scalar_one_or_none()
+    if version is None:
+        raise HTTPException(status_code=404, detail="Email account not found")
+    return version
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+
+def encode_cursor(received_at: datetime, message_id: uuid.UUID) -> str:
+    """Курсор страницы: позиция последнего письма в порядке (received_at, id)"""
+    raw = f"{received_at.isoformat()}|{message_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(cursor: str) -> Tuple[datetime, uuid.UUID]:
+    try:
+        received_at, message_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(received_at), uuid.UUID(message_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def parse_fields(fields: Optional[str]) -> List[str]:
+    if fields is None:
+        return list(MESSAGE_FIELDS)
+    names = [name.strip() for name in fields.split(",") if name.strip()]
+    unknown = [name for name in names if name not in MESSAGE_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    # id нужен клиенту всегда
+    return ["id"] + [name for name in names if name != "id"]
+
 @router.get("/email/{email_id}/messages", response_model=List[schemas.EmailMessage])
-def get_messages(email_id: uuid.UUID, db: Session = Depends(get_db)):
+async def get_messages(
+    email_id: uuid.UUID,
+    request: Request,
+    response: Response,
+    limit: int = Query(50, ge=1, le=500),
+    after: Optional[str] = None,
+    fields: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
     """
-    Получить все письма для указанного ящика
+    Получить письма для указанного ящика (новые сверху).
+
+    Постраничный вывод по курсору: limit - размер страницы, after - значение
+    заголовка X-Next-Cursor из предыдущего ответа. fields - список полей
+    через запятую (например, fields=sender,subject,received_at).
+    Поддерживается условный GET (ETag / If-None-Match).
     """
-    # Проверяем существование аккаунта
-    account = db.query(models.EmailAccount).filter(models.EmailAccount.id == email_id).first()
-    if not account:
+    field_names = parse_fields(fields)
+    query_params = {"limit": limit, "after": after, "fields": fields_key(fields, field_names)}
+    if request.headers.get("if-none-match"):
+        etag = mailbox_etag(email_id, await get_mailbox_version(db, email_id), **query_params)
+        if etag_matches(request, etag):
+            return not_modified(etag)
+
+    # Для курсора нужны received_at и id, даже если клиент их не запросил
+    columns = {name: MESSAGE_FIELDS[name] for name in field_names}
+    columns.setdefault("received_at", models.EmailMessage.received_at)
+
+    page = select(*[column.label(name) for name, column in columns.items()])\
+        .where(models.EmailMessage.email_account_id == models.EmailAccount.id)
+    if after is not None:
+        after_received_at, after_id = decode_cursor(after)
+        page = page.where(
+            tuple_(models.EmailMessage.received_at, models.EmailMessage.id) < tuple_(after_received_at, after_id),
+            # Избыточное условие по received_at: по сравнению кортежей Postgres не отсекает секции
+            models.EmailMessage.received_at <= after_received_at,
+        )
+    page = page.order_by(models.EmailMessage.received_at.desc(), models.EmailMessage.id.desc())\
+        .limit(limit + 1)\
+        .lateral()
+
+    # Проверка существования ящика и выборка писем - одним запросом
+    rows = (await db.execute(
+        select(models.EmailAccount.id.label("account_id"), models.EmailAccount.message_version, page)
+        .select_from(models.EmailAccount)
+        .outerjoin(page, true())
+        .where(models.EmailAccount.id == email_id)
+    )).mappings().all()
+    if not rows:
         raise HTTPException(status_code=404, detail="Email account not found")
-    
-    messages = db.query(models.EmailMessage)\
-        .filter(models.EmailMessage.email_account_id == email_id)\
-        .order_by(models.EmailMessage.received_at.desc())\
-        .all()
-    return messages
+
+    messages = [row for row in rows if row["id"] is not None]
+    headers = {
+        "ETag": mailbox_etag(email_id, rows[0]["message_version"], **query_params),
+        "Cache-Control": "no-cache",
+    }
+    if len(messages) > limit:
+        messages = messages[:limit]
+        headers["X-Next-Cursor"] = encode_cursor(messages[-1]["received_at"], messages[-1]["id"])
+
+    items = [{name: message[name] for name in field_names} for message in messages]
+    if fields is not None:
+        # Неполные письма не проходят через схему EmailMessage
+        return JSONResponse(content=jsonable_encoder(items), headers=headers)
+    response.headers.update(headers)
+    return items
+
+async def search_page(db: AsyncSession, q: str, limit: int, after: Optional[str], fields: Optional[str],
+                      response: Response, email_id: Optional[uuid.UUID] = None):
+    """Страница результатов поиска (новые сверху, курсор - как в get_messages)"""
+    field_names = parse_fields(fields)
+    columns = {name: MESSAGE_FIELDS[name] for name in field_names}
+    columns.setdefault("received_at", models.EmailMessage.received_at)
+
+    query = select(*[column.label(name) for name, column in columns.items()]).where(search_condition(q))
+    if email_id is not None:
+        query = query.where(models.EmailMessage.email_account_id == email_id)
+    if after is not None:
+        after_received_at, after_id = decode_cursor(after)
+        query = query.where(
+            tuple_(models.EmailMessage.received_at, models.EmailMessage.id) < tuple_(after_received_at, after_id),
+            models.EmailMessage.received_at <= after_received_at,
+        )
+    query = query.order_by(models.EmailMessage.received_at.desc(), models.EmailMessage.id.desc()).limit(limit + 1)
+    messages = (await db.execute(query)).mappings().all()
+    if not messages and email_id is not None:
+        await ensure_account_exists(db, email_id)
+
+    headers = {}
+    if len(messages) > limit:
+        messages = messages[:limit]
+        headers["X-Next-Cursor"] = encode_cursor(messages[-1]["received_at"], messages[-1]["id"])
+    items = [{name: message[name] for name in field_names} for message in messages]
+    if fields is not None:
+        return JSONResponse(content=jsonable_encoder(items), headers=headers)
+    response.headers.update(headers)
+    return items
+
+@router.get("/email/{email_id}/messages/search", response_model=List[schemas.EmailMessage])
+async def search_mailbox_messages(
+    email_id: uuid.UUID,
+    response: Response,
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(50, ge=1, le=500),
+    after: Optional[str] = None,
+    fields: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Поиск писем ящика: слова запроса ищутся в теме и тексте с учётом
+    морфологии ("регистрация" найдёт "регистрации"), поддерживаются
+    "фразы" и -исключения; подстрока - в отправителе и теме (например, q=shop.ru).
+    Постраничный вывод и fields - как в GET /email/{id}/messages.
+    """
+    return await search_page(db, q, limit, after, fields, response, email_id=email_id)
+
+@router.get("/email/{email_id}/messages/since", response_model=List[schemas.EmailMessage])
+async def get_messages_since(
+    email_id: uuid.UUID,
+    request: Request,
+    response: Response,
+    since: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=500),
+    fields: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Получить только письма, пришедшие после водяного знака since (по возрастанию seq).
+
+    Новый водяной знак возвращается в заголовке X-Watermark. Если ящик не
+    изменился, условный GET (If-None-Match) получает 304, а при since,
+    равном текущей версии, письма не читаются вовсе.
+    """
+    field_names = parse_fields(fields)
+    version = await get_mailbox_version(db, email_id)
+    etag = mailbox_etag(email_id, version, since=since, limit=limit, fields=fields_key(fields, field_names))
+    if etag_matches(request, etag):
+        return not_modified(etag)
+
+    messages = []
+    if version > since:
+        columns = {name: MESSAGE_FIELDS[name] for name in field_names}
+        columns.setdefault("seq", models.EmailMessage.seq)
+        messages = (await db.execute(
+            select(*[column.label(name) for name, column in columns.items()])
+            .where(models.EmailMessage.email_account_id == email_id, models.EmailMessage.seq > since)
+            .order_by(models.EmailMessage.seq)
+            .limit(limit)
+        )).mappings().all()
+
+    # Если страница неполная, клиент получил всё до текущей версии ящика
+    watermark = messages[-1]["seq"] if len(messages) == limit else max(version, since)
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "X-Watermark": str(watermark)}
+
+    items = [{name: message[name] for name in field_names} for message in messages]
+    if fields is not None:
+        return JSONResponse(content=jsonable_encoder(items), headers=headers)
+    response.headers.update(headers)
+    return items
+
+async def find_waited_message(email_id: uuid.UUID, since: int, subject_contains: Optional[str]):
+    """Первое письмо после водяного знака since, подходящее под фильтр"""
+    # Своя короткая сессия: соединение не держится, пока запрос ждёт письмо
+    async with AsyncSessionLocal() as db:
+        await get_mailbox_version(db, email_id)
+        query = select(models.EmailMessage)\
+            .options(undefer(models.EmailMessage.raw_message))\
+            .where(models.EmailMessage.email_account_id == email_id)
+        if since:
+            query = query.where(models.EmailMessage.seq > since)
+        if subject_contains:
+            query = query.where(models.EmailMessage.subject.icontains(subject_contains, autoescape=True))
+        # Порядок прихода - по seq: received_at берётся из заголовка Date отправителя
+        query = query.order_by(models.EmailMessage.seq, models.EmailMessage.id).limit(1)
+        return (await db.execute(query)).scalars().first()
+
+async def load_message(message_id: uuid.UUID):
+    """Загрузить письмо по ID"""
+    async with AsyncSessionLocal() as db:
+        return await db.get(models.EmailMessage, message_id, options=[undefer(models.EmailMessage.raw_message)])
+
+@router.get(
+    "/email/{email_id}/messages/wait",
+    response_model=schemas.EmailMessage,
+    responses={204: {"description": "Подходящее письмо не пришло за timeout секунд"}}
+)
+async def wait_for_message(
+    email_id: uuid.UUID,
+    timeout: float = Query(30, ge=0, le=120),
+    subject_contains: Optional[str] = None,
+    since: Optional[int] = Query(None, ge=0),
+):
+    """
+    Дождаться письма (long-poll) для автотестов.
+
+    Возвращает первое письмо после водяного знака since (seq), тема которого
+    содержит subject_contains, - сразу, если оно уже есть, иначе как только
+    оно будет сохранено. Без since ждётся следующее письмо: водяной знак -
+    версия ящика на момент запроса (since=0 - любое письмо ящика). Пока запрос ждёт, БД не опрашивается: ожидание
+    питается той же шиной уведомлений, что и WebSocket. Если письмо не пришло
+    за timeout секунд, возвращается 204.
+    """
+    needle = subject_contains.lower() if subject_contains else None
+    if since is None:
+        # Письма, уже лежащие в ящике, не подходят: иначе повторно использованный
+        # ящик сразу вернул бы старое подтверждение
+        async with AsyncSessionLocal() as db:
+            since = await get_mailbox_version(db, email_id)
+
+    def matches(message: dict) -> bool:
+        if since and (message.get("seq") or 0) <= since:
+            return False
+        return needle is None or needle in (message.get("subject") or "").lower()
+
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    # Подписываемся до проверки БД, чтобы не пропустить письмо, пришедшее между ними
+    future = ws_manager.add_waiter(str(email_id), matches)
+    try:
+        message = await find_waited_message(email_id, since, subject_contains)
+        while message is None:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return Response(status_code=204)
+            try:
+                event = await asyncio.wait_for(asyncio.shield(future), remaining)
+            except asyncio.TimeoutError:
+                return Response(status_code=204)
+
+            ws_manager.remove_waiter(str(email_id), future)
+            future = ws_manager.add_waiter(str(email_id), matches)
+            if event is None:
+                # Событие пришло без письма - проверяем БД один раз
+                message = await find_waited_message(email_id, since, subject_contains)
+            else:
+                message = await load_message(uuid.UUID(event["message_id"]))
+        return await render_message(message)
+    finally:
+        ws_manager.remove_waiter(str(email_id), future)
+
+@router.get("/messages/search", response_model=List[schemas.EmailMessage])
+async def search_all_messages(
+    response: Response,
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(50, ge=1, le=500),
+    after: Optional[str] = None,
+    fields: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Поиск писем во всех ящиках (для администратора), параметры - как
+    в GET /email/{id}/messages/search
+    """
+    return await search_page(db, q, limit, after, fields, response)
+
+async def ensure_account_exists(db: AsyncSession, email_id: uuid.UUID):
+    if not (await db.execute(select(models.EmailAccount.id).where(models.EmailAccount.id == email_id))).first():
+        raise HTTPException(status_code=404, detail="Email account not found")
+
+@router.get("/email/{email_id}/latest-code", response_model=schemas.LatestCode)
+async def get_latest_code(email_id: uuid.UUID, db: AsyncSession = Depends(get_async_db)):
+    """
+    Одноразовый код из последнего письма ящика, в котором он найден.
+    Код извлекается при приёме письма; ответ читается из одного индекса.
+    """
+    row = (await db.execute(
+        select(
+            models.EmailMessage.id.label("message_id"),
+            models.EmailMessage.received_at,
+            models.EmailMessage.seq,
+            models.EmailMessage.otp_code.label("code"),
+        )
+        .where(models.EmailMessage.email_account_id == email_id, models.EmailMessage.otp_code.isnot(None))
+        .order_by(models.EmailMessage.seq.desc())
+        .limit(1)
+    )).mappings().first()
+    if row is None:
+        await ensure_account_exists(db, email_id)
+        raise HTTPException(status_code=404, detail="Code not found")
+    return row
+
+@router.get("/email/{email_id}/latest-link", response_model=schemas.LatestLink)
+async def get_latest_link(email_id: uuid.UUID, db: AsyncSession = Depends(get_async_db)):
+    """
+    Ссылка подтверждения (регистрации, входа, сброса пароля) из последнего
+    письма ящика, в котором она найдена
+    """
+    row = (await db.execute(
+        select(
+            models.EmailMessage.id.label("message_id"),
+            models.EmailMessage.received_at,
+            models.EmailMessage.seq,
+            models.EmailMessage.confirm_link.label("link"),
+        )
+        .where(models.EmailMessage.email_account_id == email_id, models.EmailMessage.confirm_link.isnot(None))
+        .order_by(models.EmailMessage.seq.desc())
+        .limit(1)
+    )).mappings().first()
+    if row is None:
+        await ensure_account_exists(db, email_id)
+        raise HTTPException(status_code=404, detail="Link not found")
+    return row
 
 @router.get("/messages/{message_id}", response_model=schemas.EmailMessage)
-def get_message(message_id: uuid.UUID, db: Session = Depends(get_db)):
+async def get_message(message_id: uuid.UUID, db: AsyncSession = Depends(get_async_db)):
     """
     Получить конкретное письмо по ID
     """
-    message = db.query(models.EmailMessage).filter(models.EmailMessage.id == message_id).first()
+    message = await db.get(models.EmailMessage, message_id, options=[undefer(models.EmailMessage.raw_message)])
     if not message:
         raise HTTPException(status_code=404, detail="Message not found")
-    return message
+    return await render_message(message)
+
+@router.get("/messages/{message_id}/raw")
+async def get_raw_message(message_id: uuid.UUID, db: AsyncSession = Depends(get_async_db)):
+    """
+    Скачать исходное письмо (RFC 822) - только для писем, сохранённых
+    с включённым архивом (RAW_MESSAGE_STORAGE)
+    """
+    row = (await db.execute(
+        select(models.EmailMessage.raw_message, models.EmailMessage.raw_encoding)
+        .where(models.EmailMessage.id == message_id)
+    )).first()
+    if row is None:
+        raise HTTPException(status_code=404, detail="Message not found")
+    if row.raw_message is None:
+        raise HTTPException(status_code=404, detail="Raw message not stored")
+    return StreamingResponse(
+        iter_raw(row.raw_message, row.raw_encoding),
+        media_type="message/rfc822",
+        headers={"Content-Disposition": f'attachment; filename="{message_id}.eml"'},
+    )
+
+@router.get("/messages/{message_id}/attachments", response_model=List[schemas.EmailAttachment])
+async def list_message_attachments(message_id: uuid.UUID, db: AsyncSession = Depends(get_async_db)):
+    """
+    Получить список вложений письма (без содержимого)
+    """
+    attachments = (await db.execute(
+        select(models.EmailAttachment)
+        .where(models.EmailAttachment.message_id == message_id)
+        .order_by(models.EmailAttachment.created_at, models.EmailAttachment.id)
+    )).scalars().all()
+    if not attachments and not await db.get(models.EmailMessage, message_id):
+        raise HTTPException(status_code=404, detail="Message not found")
+    return attachments
+
+@router.api_route("/attachments/{attachment_id}", methods=["GET", "HEAD"])
+async def download_attachment(attachment_id: uuid.UUID, request: Request, db: AsyncSession = Depends(get_async_db)):
+    """
+    Скачать содержимое вложения.
+
+    Поддерживаются запросы диапазонов (Range, If-Range) для докачки
+    и условный GET: ETag вложения - SHA-256 его содержимого.
+    """
+    attachment = await db.get(models.EmailAttachment, attachment_id)
+    if not attachment:
+        raise HTTPException(status_code=404, detail="Attachment not found")
+
+    etag = f'"{attachment.sha256}"'
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+
+    path = get_blob_store().path(attachment.sha256)
+    try:
+        size = os.stat(path).st_size
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Attachment content not found")
+
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if if_range is not None and if_range.strip() != etag:
+        # Содержимое изменилось с момента первой загрузки - отдаём целиком
+        range_header = None
+    return RangeFileResponse(
+        path,
+        size,
+        media_type=attachment.content_type,
+        range_header=range_header,
+        etag=etag,
+        filename=attachment.filename,
+        method=request.method,
+    )
 
 @router.get("/email/by-address/{email_address}", response_model=schemas.EmailAccount)
-def get_email_account_by_address(email_address: str, db: Session = Depends(get_db)):
+async def get_email_account_by_address(email_address: str, db: AsyncSession = Depends(get_async_db)):
     """
     Получить почтовый ящик по email адресу
     """
-    account = db.query(models.EmailAccount).filter(models.EmailAccount.email == email_address).first()
+    account = (await db.execute(
+        select(models.EmailAccount).where(
+            models.EmailAccount.email == email_address,
+            models.EmailAccount.pooled.is_(False),
+        )
+    )).scalars().first()
     if not account:
         raise HTTPException(status_code=404, detail="Email account not found")
-    return account
\ No newline at end of file
+    return account
+
+@router.get("/stats/address-index")
+async def get_address_index_stats():
+    """
+    Статистика кэша адресов SMTP сервера (попадания, промахи, запросы к БД)
+    """
+    return get_address_index().stats()
+
+
+@router.get("/stats/websocket")
+async def get_websocket_stats():
+    """
+    Статистика WebSocket соединений воркера (глубина очередей, выброшенные события)
+    """
+    return ws_manager.stats()
+
+@router.get("/stats/reaper")
+async def get_reaper_stats():
+    """
+    Статистика сборщика просроченных ящиков (удалено, очередь, скорость)
+    """
+    return get_reaper().stats()
+
+@router.get("/stats/mailbox-pool")
+async def get_mailbox_pool_stats():
+    """
+    Статистика пула заранее созданных ящиков (размер, выдачи, опустошения)
+    """
+    return get_mailbox_pool().stats()
+
+@router.get("/stats/parser")
+async def get_parser_stats():
+    """
+    Статистика разбора писем встроенного SMTP сервера (на месте / в пуле процессов)
+    """
+    return get_parser_pool().stats()
@@ -0,0 +1,120 @@
+import os
+from typing import Optional, Tuple
+from urllib.parse import quote
+
+import anyio
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+# Порция чтения файла, если сервер не умеет отдавать файл без копирования
+FILE_CHUNK_SIZE = 64 * 1024
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    Разобрать заголовок Range (один диапазон байт) в пару (начало, конец включительно).
+
+    None - заголовка нет или он не поддерживается (несколько диапазонов,
+    другие единицы): отдаётся файл целиком. ValueError - диапазон
+    не пересекается с файлом (ответ 416).
+    """
+    if not header:
+        return None
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, dash, last = spec.strip().partition("-")
+    try:
+        start = int(first) if first else None
+        end = int(last) if last else None
+    except ValueError:
+        # Синтаксически неверный Range игнорируется (RFC 9110, 14.2)
+        return None
+    if not dash or (start is None and end is None):
+        return None
+    if start is None:
+        # bytes=-N: последние N байт
+        if end == 0 or size == 0:
+            raise ValueError("Пустой диапазон")
+        return max(size - end, 0), size - 1
+    if end is not None and start > end:
+        return None
+    if start >= size:
+        raise ValueError("Диапазон за пределами файла")
+    return start, size - 1 if end is None else min(end, size - 1)
+
+def content_disposition(filename: Optional[str]) -> str:
+    """Content-Disposition с именем файла в ASCII и в UTF-8 (RFC 5987)"""
+    if not filename:
+        return "attachment"
+    fallback = filename.encode("ascii", errors="replace").decode("ascii").replace('"', "'").replace("\\", "_")
+    return f"attachment; filename=\"{fallback}\"; filename*=UTF-8''{quote(filename, safe='')}"
+
+
+class RangeFileResponse(Response):
+    """
+    Отдача файла целиком или одного диапазона байт (206 / 416).
+
+    Если ASGI сервер поддерживает расширение http.response.zerocopy,
+    файл отправляется без копирования через память процесса (sendfile),
+    иначе читается порциями FILE_CHUNK_SIZE в пуле потоков.
+    """
+    def __init__(self, path: str, size: int, media_type: str, range_header: Optional[str] = None,
+                 etag: Optional[str] = None, filename: Optional[str] = None, method: str = "GET"):
+        self.path = path
+        self.method = method
+        self.status_code = 200
+        self.media_type = media_type
+        self.background = None
+        self.start, self.end = 0, size - 1
+
+        headers = {"Accept-Ranges": "bytes", "Content-Disposition": content_disposition(filename)}
+        if etag:
+            headers["ETag"] = etag
+        try:
+            selected = parse_range(range_header, size)
+        except ValueError:
+            self.status_code = 416
+            self.start, self.end = 0, -1
+            headers["Content-Range"] = f"bytes */{size}"
+        else:
+            if selected is not None:
+                self.status_code = 206
+                self.start, self.end = selected
+                headers["Content-Range"] = f"bytes {self.start}-{self.end}/{size}"
+        headers["Content-Length"] = str(self.end - self.start + 1)
+        self.init_headers(headers)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({
+            "type": "http.response.start",
+            "status": self.status_code,
+            "headers": self.raw_headers,
+        })
+        count = self.end - self.start + 1
+        if self.method == "HEAD" or count <= 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        if "http.response.zerocopy" in scope.get("extensions", {}):
+            with open(self.path, "rb") as file:
+                await send({
+                    "type": "http.response.zerocopy",
+                    "file": file.fileno(),
+                    "offset": self.start,
+                    "count": count,
+                    "more_body": False,
+                })
+            return
+
+        async with await anyio.open_file(self.path, mode="rb") as file:
+            await file.seek(self.start, os.SEEK_SET)
+            while count > 0:
+                chunk = await file.read(min(FILE_CHUNK_SIZE, count))
+                if not chunk:
+                    break
+                count -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": count > 0})
+            if count > 0:
+                # Файл оказался короче ожидаемого - закрываем тело ответа
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
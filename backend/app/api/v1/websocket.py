@@ -1,64 +1,346 @@
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect, HTTPException
-from sqlalchemy.orm import Session
-from typing import Set
-import uuid
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+from sqlalchemy.orm import undefer
+from collections import deque
+from typing import Callable, Deque, Optional, Set
+import asyncio
 import json
+import uuid
 import logging
 
-from ...database import get_db
-from ...models import EmailAccount
+from ...core.config import settings
+from ...core.logging_config import sampled
+from ...database import AsyncSessionLocal
+from ...models import EmailAccount, EmailMessage
+from ...services.metrics import get_registry
+from ...services.notification_bus import get_notification_bus
+from ...services.raw_archive import render_message
 
 logger = logging.getLogger(__name__)
 
+metrics = get_registry()
+WS_CONNECTIONS = metrics.counter("ws_connections_total", "Принятые WebSocket соединения")
+WS_SEND_SECONDS = metrics.histogram("ws_send_duration_seconds", "Отправка одного события WebSocket клиенту")
+WS_SEND_ERRORS = metrics.counter("ws_send_errors_total", "Ошибки отправки WebSocket событий")
+
 router = APIRouter()
 
-# Хранение активных WebSocket соединений: {email_account_id: Set[WebSocket]}
-active_connections: dict[str, Set[WebSocket]] = {}
+# Поля письма, которые получает клиент в режиме push для каждой проекции
+PROJECTIONS = {
+    "headers": ("id", "email_account_id", "sender", "recipient", "subject", "received_at", "seq",
+                "otp_code", "confirm_link"),
+    "text": ("id", "email_account_id", "sender", "recipient", "subject", "received_at", "seq",
+             "otp_code", "confirm_link", "body_text"),
+    "full": ("id", "email_account_id", "sender", "recipient", "subject", "received_at", "seq",
+             "otp_code", "confirm_link", "body_text", "body_html"),
+}
+
+def project_message(message: dict, projection: str) -> dict:
+    """Оставить в письме только поля выбранной проекции"""
+    return {field: message.get(field) for field in PROJECTIONS[projection]}
+
+async def load_message(message_id: str) -> Optional[dict]:
+    """Загрузить письмо целиком, если шина передала его без тела"""
+    async with AsyncSessionLocal() as db:
+        message = await db.get(EmailMessage, uuid.UUID(message_id), options=[undefer(EmailMessage.raw_message)])
+        if message is None:
+            return None
+        return json.loads((await render_message(message)).model_dump_json())
+
+class ClientConnection:
+    """
+    WebSocket клиент с собственной ограниченной очередью отправки.
+
+    Рассылка только кладёт событие в очередь, а отправкой занимается
+    отдельная задача, поэтому зависшая вкладка браузера не задерживает
+    остальных подписчиков. При переполнении очереди действует политика:
+    drop_oldest - выбросить самое старое событие,
+    coalesce - заменить очередь одним событием "mailbox_changed",
+    disconnect - закрыть соединение.
+
+    В режиме push клиент получает само письмо (в выбранной проекции)
+    с порядковым номером seq; пропуск номера означает, что события
+    были выброшены и список писем нужно перечитать.
+    """
+    def __init__(self, websocket: WebSocket, email_id: str, queue_size: int, policy: str,
+                 mode: str = "notify", projection: str = "headers"):
+        self.websocket = websocket
+        self.email_id = email_id
+        self.queue_size = queue_size
+        self.policy = policy
+        self.mode = mode
+        self.projection = projection
+        self.seq = 0
+        self.queue: Deque[dict] = deque()
+        self.dropped = 0
+        self.closed = False
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._send_loop())
+
+    def build_event(self, event: dict) -> dict:
+        """Событие шины в формате, который ожидает клиент"""
+        if self.mode != "push":
+            return {
+                "type": "new_message",
+                "email_account_id": event["email_account_id"],
+                "message_id": event["message_id"],
+            }
+        if "message" not in event:
+            # Письмо не удалось получить - клиенту нужно перечитать ящик
+            return {"type": "mailbox_changed", "email_account_id": event["email_account_id"]}
+        self.seq += 1
+        return {
+            "type": "message",
+            "seq": self.seq,
+            "message": project_message(event["message"], self.projection),
+        }
+
+    def enqueue(self, event: dict) -> int:
+        """Поставить событие в очередь, не дожидаясь отправки. Возвращает число выброшенных событий"""
+        if self.closed:
+            return 0
+        dropped = 0
+        if len(self.queue) >= self.queue_size:
+            if self.policy == "disconnect":
+                dropped = len(self.queue) + 1
+                self.queue.clear()
+                self.dropped += dropped
+                self.closed = True
+                asyncio.create_task(self.close(code=1013, reason="Slow consumer"))
+                return dropped
+            if self.policy == "coalesce":
+                last = self.queue[-1] if self.queue else None
+                if last is not None and last.get("type") == "mailbox_changed":
+                    dropped = 1
+                    event = None
+                else:
+                    dropped = len(self.queue) + 1
+                    self.queue.clear()
+                    event = {"type": "mailbox_changed", "email_account_id": self.email_id}
+            else:
+                self.queue.popleft()
+                dropped = 1
+            self.dropped += dropped
+        if event is not None:
+            self.queue.append(event)
+        self._wakeup.set()
+        return dropped
+
+    async def _send_loop(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            while self.queue:
+                event = self.queue.popleft()
+                try:
+                    with WS_SEND_SECONDS.time():
+                        await self.websocket.send_json(event)
+                except Exception as e:
+                    WS_SEND_ERRORS.inc()
+                    logger.error(f"Ошибка отправки WebSocket уведомления: {str(e)}")
+                    self.closed = True
+                    return
+
+    def stop(self):
+        """Остановить задачу отправки"""
+        self.closed = True
+        if self._task is not None:
+            self._task.cancel()
+
+    async def close(self, code: int = 1000, reason: str = ""):
+        """Остановить отправку и закрыть соединение"""
+        self.stop()
+        try:
+            await self.websocket.close(code=code, reason=reason)
+        except Exception:
+            pass
+
+class ConnectionManager:
+    """
+    WebSocket соединения текущего воркера uvicorn.
+
+    События приходят из шины уведомлений уже в цикле событий воркера,
+    и каждый воркер раскладывает их только по очередям своих сокетов.
+    """
+    def __init__(self, queue_size: int = 100, policy: str = "drop_oldest"):
+        # Хранение активных WebSocket соединений: {email_account_id: Set[ClientConnection]}
+        self.active_connections: dict[str, Set[ClientConnection]] = {}
+        self.queue_size = queue_size
+        self.policy = policy
+        self.dropped_events = 0
+        self.slow_consumers_disconnected = 0
+        # Ожидающие long-poll запросы: {email_account_id: {future: predicate}}
+        self.waiters: dict[str, dict[asyncio.Future, Callable[[dict], bool]]] = {}
+        self._loop = None
+
+    def start(self):
+        """Подписаться на шину уведомлений (вызывается в цикле событий воркера)"""
+        self._loop = asyncio.get_running_loop()
+        bus = get_notification_bus()
+        bus.subscribe(self.handle_event, loop=self._loop)
+        bus.start()
+
+    def stop(self):
+        """Отписаться от шины уведомлений"""
+        bus = get_notification_bus()
+        bus.unsubscribe(self.handle_event)
+        bus.stop()
+
+    def connect(self, email_id: str, websocket: WebSocket,
+                mode: str = "notify", projection: str = "headers") -> ClientConnection:
+        connection = ClientConnection(websocket, email_id, self.queue_size, self.policy, mode, projection)
+        connection.start()
+        self.active_connections.setdefault(email_id, set()).add(connection)
+        return connection
 
-def get_db_sync():
-    """Синхронная функция для получения БД"""
-    from ...database import SessionLocal
-    return SessionLocal()
+    def disconnect(self, email_id: str, connection: ClientConnection):
+        connection.stop()
+        connections = self.active_connections.get(email_id)
+        if connections is None:
+            return
+        connections.discard(connection)
+        if not connections:
+            del self.active_connections[email_id]
+
+    def add_waiter(self, email_id: str, predicate: Callable[[dict], bool]) -> asyncio.Future:
+        """
+        Зарегистрировать ожидание письма, подходящего под predicate.
+        Future получает событие шины; если письма в событии нет (не поместилось
+        в NOTIFY), future получает None и ожидающий сам проверяет БД.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self.waiters.setdefault(email_id, {})[future] = predicate
+        return future
+
+    def remove_waiter(self, email_id: str, future: asyncio.Future):
+        waiters = self.waiters.get(email_id)
+        if waiters is None:
+            return
+        waiters.pop(future, None)
+        if not waiters:
+            del self.waiters[email_id]
+
+    def _wake_waiters(self, email_id: str, event: dict):
+        for future, predicate in list(self.waiters.get(email_id, {}).items()):
+            if future.done():
+                continue
+            message = event.get("message")
+            if message is None:
+                future.set_result(None)
+            elif predicate(message):
+                future.set_result(event)
+
+    def handle_event(self, event: dict):
+        """Обработать событие шины: поставить новое письмо в очереди подписчиков ящика"""
+        if event.get("type") != "new_message":
+            return
+        email_id = event.get("email_account_id")
+        if email_id in self.waiters:
+            self._wake_waiters(email_id, event)
+        connections = self.active_connections.get(email_id)
+        if not connections:
+            return
+        # Шина могла передать письмо без тела (ограничение размера NOTIFY) -
+        # дочитываем его из БД один раз, если кто-то из клиентов ждёт тело
+        if event.get("truncated") and any(
+            c.mode == "push" and ("message" not in event or c.projection != "headers")
+            for c in connections
+        ):
+            asyncio.create_task(self._load_and_broadcast(email_id, event))
+            return
+        self.broadcast(email_id, event)
+
+    async def _load_and_broadcast(self, email_id: str, event: dict):
+        try:
+            message = await load_message(event["message_id"])
+        except Exception as e:
+            logger.error(f"Ошибка загрузки письма {event['message_id']}: {str(e)}")
+            message = None
+        if message is not None:
+            event = dict(event, message=message, truncated=False)
+        self.broadcast(email_id, event)
+
+    def broadcast(self, email_id: str, event: dict):
+        """Уведомление всех WebSocket клиентов ящика (только постановка в очереди)"""
+        for connection in list(self.active_connections.get(email_id, ())):
+            dropped = connection.enqueue(connection.build_event(event))
+            if dropped:
+                self.dropped_events += dropped
+                if connection.policy == "disconnect":
+                    self.slow_consumers_disconnected += 1
+                    self.disconnect(email_id, connection)
+
+    def stats(self) -> dict:
+        """Метрики WebSocket соединений: глубина очередей и выброшенные события"""
+        depths = [len(c.queue) for conns in self.active_connections.values() for c in conns]
+        return {
+            "connections": len(depths),
+            "mailboxes": len(self.active_connections),
+            "queue_depth_total": sum(depths),
+            "queue_depth_max": max(depths, default=0),
+            "dropped_events": self.dropped_events,
+            "slow_consumers_disconnected": self.slow_consumers_disconnected,
+            "waiters": sum(len(waiters) for waiters in self.waiters.values()),
+            "policy": self.policy,
+        }
+
+manager = ConnectionManager(
+    queue_size=settings.WS_SEND_QUEUE_SIZE,
+    policy=settings.WS_SLOW_CONSUMER_POLICY,
+)
+
+async def find_account(email_id: str) -> Optional[EmailAccount]:
+    """Найти ящик для рукопожатия; соединение с БД возвращается в пул сразу после запроса"""
+    try:
+        account_id = uuid.UUID(email_id)
+    except ValueError:
+        return None
+    async with AsyncSessionLocal() as db:
+        account = await db.get(EmailAccount, account_id)
+    # Ящик пула ещё никому не выдан
+    return account if account is not None and not account.pooled else None
 
 @router.websocket("/ws/{email_id}")
-async def websocket_endpoint(websocket: WebSocket, email_id: str):
+async def websocket_endpoint(websocket: WebSocket, email_id: str, mode: str = "notify", projection: str = "headers"):
     """
-    WebSocket endpoint для real-time уведомлений о новых письмах
+    WebSocket endpoint для real-time уведомлений о новых письмах.
+
+    mode=notify - событие new_message только с ID письма (по умолчанию),
+    mode=push - письмо целиком в проекции projection (headers | text | full)
     """
     await websocket.accept()
-    
+    WS_CONNECTIONS.inc()
+    connection = None
+
+    if mode not in ("notify", "push") or projection not in PROJECTIONS:
+        await websocket.close(code=1008, reason="Unsupported mode or projection")
+        return
+
     try:
         # Проверяем существование email аккаунта
-        db = get_db_sync()
         try:
-            account = db.query(EmailAccount).filter(
-                EmailAccount.id == uuid.UUID(email_id)
-            ).first()
-            
+            account = await find_account(email_id)
+
             if not account:
                 await websocket.close(code=1008, reason="Email account not found")
                 return
-            
-            # Добавляем подключение
-            if email_id not in active_connections:
-                active_connections[email_id] = set()
-            active_connections[email_id].add(websocket)
-            
-            logger.info(f"WebSocket подключен для email_id: {email_id}")
-            
+
             # Отправляем подтверждение подключения
             await websocket.send_json({
                 "type": "connected",
                 "email_id": email_id,
-                "email": account.email
+                "email": account.email,
+                "mode": mode,
+                "projection": projection
             })
-            
-            # Синхронизируем с глобальным словарем для SMTP сервера
-            from ...services.smtp_server import websocket_connections
-            if email_id not in websocket_connections:
-                websocket_connections[email_id] = []
-            websocket_connections[email_id].append(websocket)
-            
+
+            # Добавляем подключение
+            connection = manager.connect(email_id, websocket, mode, projection)
+
+            logger.info("WebSocket подключен для email_id: %s", email_id, extra=sampled(email_id=email_id, mode=mode))
+
             # Ждем сообщений от клиента (ping/pong)
             while True:
                 try:
@@ -68,30 +350,16 @@ async def websocket_endpoint(websocket: WebSocket, email_id: str):
                         await websocket.send_text("pong")
                 except WebSocketDisconnect:
                     break
-                    
+
         except Exception as e:
             logger.error(f"Ошибка WebSocket: {str(e)}")
             await websocket.close(code=1011, reason=str(e))
-        finally:
-            db.close()
-    
+
     except WebSocketDisconnect:
-        logger.info(f"WebSocket отключен для email_id: {email_id}")
+        logger.info("WebSocket отключен для email_id: %s", email_id, extra=sampled(email_id=email_id))
     except Exception as e:
         logger.error(f"Ошибка WebSocket соединения: {str(e)}")
     finally:
         # Удаляем подключение
-        if email_id in active_connections:
-            active_connections[email_id].discard(websocket)
-            if not active_connections[email_id]:
-                del active_connections[email_id]
-        
-        # Удаляем из глобального словаря SMTP сервера
-        from ...services.smtp_server import websocket_connections
-        if email_id in websocket_connections:
-            try:
-                websocket_connections[email_id].remove(websocket)
-                if not websocket_connections[email_id]:
-                    del websocket_connections[email_id]
-            except ValueError:
-                pass
\ No newline at end of file
+        if connection is not None:
+            manager.disconnect(email_id, connection)
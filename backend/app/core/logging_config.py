@@ -0,0 +1,147 @@
+import atexit
+import json
+import logging
+import queue
+import random
+import sys
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Optional
+
+from .config import settings
+
+# Короткие имена подсистем для LOG_LEVELS (можно указывать и полное имя логгера)
+SUBSYSTEMS = {
+    "api": "app.api",
+    "smtp": "app.services.smtp_server",
+    # Протокол SMTP (aiosmtpd пишет строку INFO на каждую команду сессии)
+    "aiosmtpd": "mail.log",
+    "parser": "app.services.parser_pool",
+    "writer": "app.services.message_writer",
+    "bus": "app.services.notification_bus",
+    "ws": "app.api.v1.websocket",
+    "reaper": "app.services.reaper",
+    "pool": "app.services.mailbox_pool",
+    "db": "sqlalchemy.engine",
+}
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+# Атрибуты любой записи лога: всё остальное пришло через extra и выводится как поля JSON
+RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "sampled"}
+
+_listener: Optional[QueueListener] = None
+
+
+def sampled(**fields) -> dict:
+    """
+    extra для событий каждого письма: такие записи уровня DEBUG и INFO
+    пропускаются с вероятностью LOG_SAMPLE_RATE, остальные поля
+    попадают в JSON как есть.
+
+        logger.debug("Письмо сохранено", extra=sampled(message_id=..., duration_ms=...))
+    """
+    fields["sampled"] = True
+    return fields
+
+
+class SamplingFilter(logging.Filter):
+    """Отбрасывает часть помеченных sampled() записей до постановки в очередь"""
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.rate >= 1 or record.levelno > logging.INFO or not getattr(record, "sampled", False):
+            return True
+        return random.random() < self.rate
+
+
+class JSONFormatter(logging.Formatter):
+    """Запись лога одной строкой JSON: время, уровень, логгер, сообщение и поля из extra"""
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class LogQueueHandler(QueueHandler):
+    """
+    Постановка записи в очередь без форматирования: сообщение и traceback
+    вычисляются здесь (аргументы могут измениться позже), а итоговый текст
+    или JSON строит поток QueueListener.
+    """
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def parse_levels(value: str) -> Dict[str, int]:
+    """LOG_LEVELS: "smtp=DEBUG,db=WARNING,app.services.blob_store=ERROR" -> {логгер: уровень}"""
+    levels = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        name, _, level = item.partition("=")
+        name = name.strip()
+        level = level.strip().upper()
+        if not level or not isinstance(logging.getLevelName(level), int):
+            raise ValueError(f"Неверный уровень логирования: {item!r}")
+        levels[SUBSYSTEMS.get(name, name)] = logging.getLevelName(level)
+    return levels
+
+def setup_logging():
+    """
+    Настроить логирование процесса (API, SMTP сервер, сборщик).
+
+    Записи только кладутся в очередь, а в stdout их пишет поток
+    QueueListener: медленный терминал или pipe не задерживает цикл
+    событий. LOG_FORMAT=json - по записи JSON на строку. Повторный
+    вызов ничего не делает.
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    if settings.LOG_FORMAT.strip().lower() == "json":
+        stream_handler.setFormatter(JSONFormatter())
+    else:
+        stream_handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = LogQueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(settings.LOG_SAMPLE_RATE))
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(settings.LOG_LEVEL.upper())
+    for name, level in parse_levels(settings.LOG_LEVELS).items():
+        logging.getLogger(name).setLevel(level)
+
+    _listener = QueueListener(log_queue, stream_handler)
+    _listener.start()
+    # При выходе дописываем всё, что осталось в очереди
+    atexit.register(stop_logging)
+
+def stop_logging():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
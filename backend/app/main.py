@@ -1,15 +1,15 @@
 import logging
-from fastapi import FastAPI
+from fastapi import FastAPI, Response
 from fastapi.middleware.cors import CORSMiddleware
 from .core.config import settings
+from .core.logging_config import setup_logging
+from .services.metrics import CONTENT_TYPE, HTTPMetricsMiddleware, get_registry
 from .api.v1.endpoints import router as api_router
-from .api.v1.websocket import router as ws_router
+from .api.v1.websocket import router as ws_router, manager as ws_manager
 
-# Настройка логирования
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+# Настройка логирования (запись в stdout - в отдельном потоке)
+setup_logging()
+logger = logging.getLogger(__name__)
 
 app = FastAPI(
     title="ПМ АТВ API",
@@ -24,10 +24,16 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Watermark", "ETag"],
 )
 
+# Число и длительность запросов по шаблонам маршрутов для /metrics
+app.add_middleware(HTTPMetricsMiddleware)
+
 app.include_router(api_router, prefix="/api/v1")
 app.include_router(ws_router)
+# Расширение и README обращаются к WebSocket по /api/v1/ws/{email_id}
+app.include_router(ws_router, prefix="/api/v1")
 
 @app.get("/")
 def read_root():
@@ -37,22 +43,56 @@ def read_root():
 def health_check():
     return {"status": "healthy"}
 
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    """Метрики воркера в текстовом формате Prometheus"""
+    # Заголовок задаётся целиком: media_type text/* Starlette дополнил бы вторым charset
+    return Response(get_registry().render(), headers={"Content-Type": CONTENT_TYPE})
+
 @app.on_event("startup")
 def startup_event():
     from .database import Base, engine
-    print("Создание таблиц при запуске...")
+    logger.info("Создание таблиц при запуске...")
     Base.metadata.create_all(bind=engine)
-    print("✅ Таблицы готовы")
+    logger.info("✅ Таблицы готовы")
     
-    # Запускаем SMTP сервер ---- РАСКОММЕНТИТЬ
-    #from .services.smtp_server import get_smtp_server
-    #smtp = get_smtp_server()
-    #smtp.start()
-    #print(f"✅ SMTP сервер запущен на {settings.SMTP_HOST}:{settings.SMTP_PORT}")
+    # SMTP сервер внутри процесса API (иначе запускается отдельно: python -m app.services.smtp_server)
+    if settings.SMTP_EMBEDDED:
+        from .services.smtp_server import get_smtp_server
+        smtp = get_smtp_server()
+        smtp.start()
+        logger.info(f"✅ SMTP сервер запущен на {settings.SMTP_HOST}:{settings.SMTP_PORT}")
+
+@app.on_event("startup")
+async def start_notifications():
+    # Подписываем WebSocket соединения этого воркера на шину уведомлений
+    ws_manager.start()
+    # Пополнение пула заранее созданных ящиков
+    from .services.mailbox_pool import get_mailbox_pool
+    get_mailbox_pool().start()
+    # Сборщик просроченных ящиков (в кластере работает только один, см. advisory lock)
+    if settings.REAPER_ENABLED:
+        from .services.reaper import get_reaper
+        get_reaper().start()
+        get_registry().add_collector("reaper", get_reaper().stats)
+    get_registry().add_collector("websocket", ws_manager.stats)
+    get_registry().add_collector("mailbox_pool", get_mailbox_pool().stats)
 
 @app.on_event("shutdown")
 def shutdown_event():
-    from .services.smtp_server import get_smtp_server
-    smtp = get_smtp_server()
-    smtp.stop()
-    print("✅ SMTP сервер остановлен")
\ No newline at end of file
+    ws_manager.stop()
+    from .services.mailbox_pool import get_mailbox_pool
+    get_mailbox_pool().stop()
+    if settings.REAPER_ENABLED:
+        from .services.reaper import get_reaper
+        get_reaper().stop()
+    if settings.SMTP_EMBEDDED:
+        from .services.smtp_server import get_smtp_server
+        smtp = get_smtp_server()
+        smtp.stop()
+        logger.info("✅ SMTP сервер остановлен")
+
+@app.on_event("shutdown")
+async def close_async_engine():
+    from .database import async_engine
+    await async_engine.dispose()
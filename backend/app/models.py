@@ -1,5 +1,6 @@
-from sqlalchemy import Column, String, DateTime, Boolean, Text, ForeignKey
-from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy import Column, String, DateTime, Boolean, Text, ForeignKey, Index, BigInteger, LargeBinary
+from sqlalchemy.dialects.postgresql import TSVECTOR, UUID
+from sqlalchemy.orm import deferred
 from sqlalchemy.sql import func
 import uuid
 from .database import Base
@@ -12,6 +13,17 @@ class EmailAccount(Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     expires_at = Column(DateTime(timezone=True), nullable=True)  # <-- Делаем nullable=True
     is_active = Column(Boolean, default=True)
+    # Счётчик писем ящика: растёт с каждым сохранённым письмом, служит версией для ETag
+    message_version = Column(BigInteger, nullable=False, default=0, server_default="0")
+    # Ящик ещё в пуле заранее созданных и никому не выдан
+    pooled = Column(Boolean, nullable=False, default=False, server_default="false")
+    
+    __table_args__ = (
+        # Поиск просроченных ящиков сборщиком
+        Index("idx_email_accounts_expires_at", "expires_at"),
+        # Выдача ящиков из пула
+        Index("idx_email_accounts_pooled", "id", postgresql_where=pooled),
+    )
     
 class EmailMessage(Base):
     __tablename__ = "email_messages"
@@ -23,4 +35,53 @@ class EmailMessage(Base):
     subject = Column(Text)
     body_text = Column(Text)
     body_html = Column(Text)
-    received_at = Column(DateTime(timezone=True), server_default=func.now())
\ No newline at end of file
+    received_at = Column(DateTime(timezone=True), server_default=func.now())
+    # Порядковый номер письма в ящике (значение message_version после его сохранения)
+    seq = Column(BigInteger, nullable=True)
+    # Сжатое исходное письмо (RAW_MESSAGE_STORAGE): тогда body_text и body_html не хранятся
+    # и раскодируются только при запросе письма; списки писем колонку не загружают
+    raw_message = deferred(Column(LargeBinary, nullable=True))
+    raw_encoding = Column(String(16), nullable=True)
+    # Код и ссылка подтверждения, извлечённые при приёме письма
+    otp_code = Column(String(16), nullable=True)
+    confirm_link = Column(Text, nullable=True)
+    # Полнотекстовый индекс темы и тела, заполняется при приёме письма
+    search_vector = deferred(Column(TSVECTOR, nullable=True))
+    
+    __table_args__ = (
+        # Постраничный вывод писем ящика по курсору (received_at, id)
+        Index("idx_email_messages_account_received", "email_account_id", "received_at", "id"),
+        # Инкрементальная синхронизация по seq
+        Index("idx_email_messages_account_seq", "email_account_id", "seq"),
+        # Последний код ящика - из одного индекса, без чтения строк писем
+        Index(
+            "idx_email_messages_account_code", "email_account_id", "seq",
+            postgresql_include=["otp_code", "id", "received_at"],
+            postgresql_where=otp_code.isnot(None),
+        ),
+        Index("idx_email_messages_account_link", "email_account_id", "seq", postgresql_where=confirm_link.isnot(None)),
+        # Поиск писем; триграммные индексы на sender и subject (pg_trgm) - в migrations/init.sql
+        Index("idx_email_messages_search", "search_vector", postgresql_using="gin"),
+    )
+
+class EmailAttachment(Base):
+    __tablename__ = "email_attachments"
+    
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    # Без внешних ключей: письма секционированной таблицы удаляются целыми секциями
+    message_id = Column(UUID(as_uuid=True), nullable=False)
+    email_account_id = Column(UUID(as_uuid=True), nullable=False)
+    filename = Column(Text)
+    content_type = Column(String(255), nullable=False)
+    size = Column(BigInteger, nullable=False)
+    # Ключ содержимого в хранилище вложений: одинаковые файлы хранятся один раз
+    sha256 = Column(String(64), nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    
+    __table_args__ = (
+        Index("idx_email_attachments_message", "message_id"),
+        # Удаление вложений вместе с ящиком
+        Index("idx_email_attachments_account", "email_account_id"),
+        # Проверка, осталась ли ссылка на содержимое в хранилище
+        Index("idx_email_attachments_sha256", "sha256"),
+    )
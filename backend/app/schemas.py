@@ -14,6 +14,7 @@ class EmailAccount(EmailAccountBase):
     created_at: datetime
     expires_at: Optional[datetime] = None  # <-- Делаем опциональным
     is_active: bool
+    message_version: int = 0
     
     class Config:
         from_attributes = True
@@ -31,6 +32,33 @@ class EmailMessage(EmailMessageCreate):
     id: uuid.UUID
     email_account_id: uuid.UUID
     received_at: datetime
+    seq: Optional[int] = None
+    otp_code: Optional[str] = None
+    confirm_link: Optional[str] = None
     
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+class LatestCode(BaseModel):
+    message_id: uuid.UUID
+    received_at: datetime
+    seq: Optional[int] = None
+    code: str
+
+class LatestLink(BaseModel):
+    message_id: uuid.UUID
+    received_at: datetime
+    seq: Optional[int] = None
+    link: str
+
+class EmailAttachment(BaseModel):
+    id: uuid.UUID
+    message_id: uuid.UUID
+    filename: Optional[str] = None
+    content_type: str
+    size: int
+    sha256: str
+    created_at: datetime
+    
+    class Config:
+        from_attributes = True
@@ -0,0 +1,142 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from ..core.config import settings
+
+
+class AddressIndex:
+    """
+    Кэш соответствия адрес -> ID почтового ящика для SMTP сервера.
+
+    Найденные ящики хранятся с LRU-вытеснением и живут не дольше
+    срока действия ящика (expires_at) и не дольше ttl_seconds.
+    Адреса, которых нет в БД (или чей ящик просрочен), попадают в отрицательный кэш на
+    negative_ttl_seconds, чтобы спам и повторы на удалённые ящики
+    не доходили до Postgres.
+    """
+    def __init__(self, max_size: int = 100000, ttl_seconds: int = 300, negative_ttl_seconds: int = 60):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.negative_ttl_seconds = negative_ttl_seconds
+        # {email: (account_id, valid_until)}
+        self._entries: "OrderedDict[str, Tuple[object, float]]" = OrderedDict()
+        # {email: valid_until}
+        self._negative: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lookup_queries = 0
+
+    def lookup(self, addresses: Iterable[str]) -> Tuple[Dict[str, object], List[str]]:
+        """
+        Найти адреса в кэше.
+        Возвращает найденные ящики {email: account_id} и список адресов,
+        которые нужно загрузить из БД.
+        """
+        found = {}
+        unknown = []
+        now = time.time()
+        with self._lock:
+            for address in addresses:
+                entry = self._entries.get(address)
+                if entry is not None:
+                    if entry[1] > now:
+                        self._entries.move_to_end(address)
+                        found[address] = entry[0]
+                        self.hits += 1
+                        continue
+                    del self._entries[address]
+
+                negative_until = self._negative.get(address)
+                if negative_until is not None:
+                    if negative_until > now:
+                        self.negative_hits += 1
+                        continue
+                    del self._negative[address]
+
+                self.misses += 1
+                unknown.append(address)
+        return found, unknown
+
+    def store(self, loaded: Dict[str, Tuple[object, Optional[datetime]]], missing: Iterable[str]) -> Dict[str, object]:
+        """
+        Сохранить результат запроса к БД:
+        loaded - {email: (account_id, expires_at)}, missing - адреса, которых нет в БД.
+        Возвращает действующие ящики из loaded {email: account_id}.
+        """
+        now = time.time()
+        live = {}
+        with self._lock:
+            self.lookup_queries += 1
+            for address, (account_id, expires_at) in loaded.items():
+                valid_until = now + self.ttl_seconds
+                if expires_at is not None:
+                    valid_until = min(valid_until, expires_at.timestamp())
+                if valid_until <= now:
+                    # Ящик уже просрочен: писем на него не принимаем, как и на несуществующий
+                    self._entries.pop(address, None)
+                    self._negative[address] = now + self.negative_ttl_seconds
+                    self._negative.move_to_end(address)
+                    continue
+                self._negative.pop(address, None)
+                self._entries[address] = (account_id, valid_until)
+                self._entries.move_to_end(address)
+                live[address] = account_id
+
+            for address in missing:
+                self._negative[address] = now + self.negative_ttl_seconds
+                self._negative.move_to_end(address)
+
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            while len(self._negative) > self.max_size:
+                self._negative.popitem(last=False)
+                self.evictions += 1
+        return live
+
+    def invalidate(self, address: str):
+        """Удалить адрес из кэша (при создании или удалении ящика)"""
+        with self._lock:
+            self._entries.pop(address, None)
+            self._negative.pop(address, None)
+
+    def clear(self):
+        """Полностью очистить кэш"""
+        with self._lock:
+            self._entries.clear()
+            self._negative.clear()
+
+    def stats(self) -> dict:
+        """Счётчики попаданий и промахов кэша"""
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "negative_size": len(self._negative),
+                "hits": self.hits,
+                "negative_hits": self.negative_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "lookup_queries": self.lookup_queries,
+            }
+
+
+# Глобальный экземпляр кэша адресов
+address_index = None
+
+def get_address_index() -> AddressIndex:
+    """Получить глобальный экземпляр кэша адресов"""
+    global address_index
+    if address_index is None:
+        address_index = AddressIndex(
+            max_size=settings.ADDRESS_INDEX_MAX_SIZE,
+            ttl_seconds=settings.ADDRESS_INDEX_TTL_SECONDS,
+            negative_ttl_seconds=settings.ADDRESS_INDEX_NEGATIVE_TTL_SECONDS,
+        )
+    return address_index
@@ -0,0 +1,139 @@
+import logging
+import os
+import shutil
+import uuid
+from abc import ABC, abstractmethod
+from typing import Iterable, List
+
+from sqlalchemy import text
+
+from ..core.config import settings
+from ..database import engine
+
+logger = logging.getLogger(__name__)
+
+# Запись содержимого и строк вложений держит разделяемую блокировку хэша до фиксации,
+# сборка мусора - исключительную: файл не удалится между записью и COMMIT
+LOCK_BLOBS_SHARED = text("SELECT pg_advisory_xact_lock_shared(hashtext(h)) FROM unnest(CAST(:hashes AS varchar[])) AS h")
+TRY_LOCK_BLOB = text("SELECT pg_try_advisory_xact_lock(hashtext(:sha256))")
+BLOB_REFERENCED = text("SELECT EXISTS (SELECT 1 FROM email_attachments WHERE sha256 = :sha256)")
+
+
+class BlobStore(ABC):
+    """
+    Хранилище содержимого вложений, адресуемое SHA-256.
+
+    Одинаковые файлы (например, один и тот же шаблон счёта, разосланный
+    в тысячи ящиков) хранятся один раз; строки email_attachments лишь
+    ссылаются на хэш.
+    """
+    @abstractmethod
+    def put(self, path: str, sha256: str) -> bool:
+        """
+        Сохранить содержимое временного файла в хранилище под ключом sha256.
+        Временный файл остаётся на месте: его удаляет владелец после фиксации
+        транзакции (при откате повторная запись письма снова его использует).
+        Возвращает False, если такое содержимое уже было.
+        """
+
+    @abstractmethod
+    def path(self, sha256: str) -> str:
+        """Путь к содержимому на диске (для отдачи файла клиенту)"""
+
+    @abstractmethod
+    def delete(self, sha256: str) -> bool:
+        """Удалить содержимое (вызывается только из release_blobs)"""
+
+
+class LocalBlobStore(BlobStore):
+    """
+    Хранилище в локальном каталоге: root/ab/cd/abcd... (два уровня
+    подкаталогов, чтобы не складывать миллионы файлов в один).
+    """
+    def __init__(self, root: str):
+        self.root = root
+
+    def path(self, sha256: str) -> str:
+        return os.path.join(self.root, sha256[:2], sha256[2:4], sha256)
+
+    def put(self, path: str, sha256: str) -> bool:
+        target = self.path(sha256)
+        if os.path.exists(target):
+            return False
+        directory = os.path.dirname(target)
+        os.makedirs(directory, exist_ok=True)
+        # Содержимое появляется под ключом только целиком: через файл рядом и переименование
+        staging = os.path.join(directory, f".staging-{uuid.uuid4().hex}")
+        try:
+            try:
+                # В пределах одной файловой системы - жёсткая ссылка, без копирования
+                os.link(path, staging)
+            except OSError:
+                # Временный каталог на другом диске (или без жёстких ссылок) - копируем
+                shutil.copyfile(path, staging)
+            os.replace(staging, target)
+        except BaseException:
+            # Недописанный файл никто не соберёт - удаляем сразу
+            try:
+                os.unlink(staging)
+            except FileNotFoundError:
+                pass
+            raise
+        return True
+
+    def delete(self, sha256: str) -> bool:
+        try:
+            os.unlink(self.path(sha256))
+            return True
+        except FileNotFoundError:
+            return False
+
+
+def release_blobs(hashes: Iterable[str]) -> int:
+    """
+    Удалить из хранилища содержимое, на которое после удаления вложений
+    не осталось ссылок (блокирует, вызывать вне цикла событий).
+    Хэш, который сейчас записывается вместе с новым письмом, пропускается:
+    после фиксации на него появится ссылка.
+    """
+    store = get_blob_store()
+    released = 0
+    with engine.connect() as connection:
+        for sha256 in sorted(set(hashes)):
+            locked = connection.execute(TRY_LOCK_BLOB, {"sha256": sha256}).scalar()
+            if locked and not connection.execute(BLOB_REFERENCED, {"sha256": sha256}).scalar():
+                released += store.delete(sha256)
+            connection.commit()
+    return released
+
+def store_attachments(db, attachments: List[dict]):
+    """
+    Сохранить содержимое временных файлов вложений в хранилище внутри
+    транзакции db, которая затем запишет строки email_attachments.
+    Временные файлы не удаляются: при откате транзакции письмо можно записать заново.
+    """
+    hashes = sorted({attachment["sha256"] for attachment in attachments})
+    if not hashes:
+        return
+    db.execute(LOCK_BLOBS_SHARED, {"hashes": hashes})
+    store = get_blob_store()
+    stored = set()
+    for attachment in attachments:
+        # Копии письма для разных получателей ссылаются на один временный файл
+        if attachment["path"] not in stored:
+            store.put(attachment["path"], attachment["sha256"])
+            stored.add(attachment["path"])
+
+
+# Глобальный экземпляр хранилища
+blob_store = None
+
+def get_blob_store() -> BlobStore:
+    """Получить глобальный экземпляр хранилища вложений"""
+    global blob_store
+    if blob_store is None:
+        if settings.BLOB_STORE_BACKEND == "local":
+            blob_store = LocalBlobStore(settings.BLOB_STORE_PATH)
+        else:
+            raise ValueError(f"Неизвестный BLOB_STORE_BACKEND: {settings.BLOB_STORE_BACKEND}")
+    return blob_store
@@ -1,73 +1,232 @@
-import email
+import binascii
+import codecs
+import functools
+import hashlib
+import logging
+import os
+import re
+import tempfile
+from email.header import decode_header, make_header
+from email.message import Message
+from email.parser import BytesFeedParser
 from email.utils import parsedate_to_datetime
-from typing import Optional, Tuple
+from typing import BinaryIO, List, Optional, Tuple
 
-def parse_email_message(raw_message: bytes) -> dict:
+from ..core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Порция, которой сообщение подаётся парсеру: без копии всего письма в str
+FEED_CHUNK_SIZE = 64 * 1024
+# Порция base64 текста вложения, декодируемая за раз
+DECODE_CHUNK_CHARS = 1024 * 1024
+# Кодировка текста без параметра charset
+DEFAULT_CHARSET = "utf-8"
+# HTML без charset в заголовке: ищем <meta charset> в начале документа
+HTML_META_CHARSET = re.compile(rb"""<meta[^>]+charset\s*=\s*["']?([\w.:-]+)""", re.IGNORECASE)
+HTML_META_SCAN_BYTES = 2048
+
+def parse_email_message(raw_message: bytes, max_body_chars: Optional[int] = None,
+                        spool_dir: Optional[str] = None, with_attachments: bool = True) -> dict:
     """
-    Парсинг входящего email сообщения
+    Парсинг входящего email сообщения за один проход.
+
+    Текст и HTML обрезаются до max_body_chars символов, вложения
+    декодируются по одному и сразу выгружаются во временные файлы
+    в spool_dir (см. discard_attachments), а не копятся в памяти.
+    with_attachments=False - вложения пропускаются без декодирования.
     """
+    if max_body_chars is None:
+        max_body_chars = settings.PARSER_MAX_BODY_CHARS
+    attachments: List[dict] = []
     try:
-        msg = email.message_from_bytes(raw_message)
-        
-        # Извлекаем заголовки
-        sender = msg.get("From", "")
-        recipient = msg.get("To", "")
-        subject = msg.get("Subject", "")
+        parser = BytesFeedParser()
+        view = memoryview(raw_message)
+        for offset in range(0, len(view), FEED_CHUNK_SIZE):
+            parser.feed(bytes(view[offset:offset + FEED_CHUNK_SIZE]))
+        msg = parser.close()
+
+        # Извлекаем заголовки (RFC 2047: "=?koi8-r?B?...?=" -> текст)
+        sender = decode_header_value(msg.get("From", ""))
+        recipient = decode_header_value(msg.get("To", ""))
+        subject = decode_header_value(msg.get("Subject", ""))
         date_str = msg.get("Date", "")
-        
+
         # Парсим дату
         received_at = None
         if date_str:
             try:
                 received_at = parsedate_to_datetime(date_str)
-            except:
+            except (TypeError, ValueError):
                 pass
-        
+
         # Извлекаем тело письма
         body_text = None
         body_html = None
-        
-        if msg.is_multipart():
-            for part in msg.walk():
-                content_type = part.get_content_type()
-                content_disposition = str(part.get("Content-Disposition", ""))
-                
-                # Пропускаем вложения
-                if "attachment" in content_disposition:
-                    continue
-                
-                # Текстовое содержимое
-                if content_type == "text/plain" and body_text is None:
-                    try:
-                        body_text = part.get_payload(decode=True).decode("utf-8", errors="ignore")
-                    except:
-                        pass
-                elif content_type == "text/html" and body_html is None:
-                    try:
-                        body_html = part.get_payload(decode=True).decode("utf-8", errors="ignore")
-                    except:
-                        pass
-        else:
-            # Простое сообщение
-            content_type = msg.get_content_type()
-            payload = msg.get_payload(decode=True)
-            if payload:
-                try:
-                    decoded = payload.decode("utf-8", errors="ignore")
-                    if content_type == "text/html":
-                        body_html = decoded
-                    else:
-                        body_text = decoded
-                except:
-                    pass
-        
+
+        for part in msg.walk():
+            if part.is_multipart():
+                continue
+
+            # Вложения - во временные файлы
+            if is_attachment(part):
+                if with_attachments:
+                    attachments.append(spool_attachment(part, spool_dir))
+                continue
+
+            content_type = part.get_content_type()
+            if content_type == "text/plain" and body_text is None:
+                body_text = decode_body(part, max_body_chars)
+            elif content_type == "text/html" and body_html is None:
+                body_html = decode_body(part, max_body_chars)
+            elif not msg.is_multipart() and body_text is None:
+                # Простое сообщение с нестандартным типом содержимого
+                body_text = decode_body(part, max_body_chars)
+
+            # Оба тела найдены, а вложения не нужны - остальные части не просматриваем
+            if body_text is not None and body_html is not None and not with_attachments:
+                break
+
         return {
             "sender": sender,
             "recipient": recipient,
             "subject": subject,
             "body_text": body_text,
             "body_html": body_html,
-            "received_at": received_at
+            "received_at": received_at,
+            "attachments": attachments
         }
     except Exception as e:
-        raise ValueError(f"Ошибка парсинга email: {str(e)}")
\ No newline at end of file
+        discard_attachments(attachments)
+        raise ValueError(f"Ошибка парсинга email: {str(e)}")
+
+def is_attachment(part: Message) -> bool:
+    """Часть письма - вложение (явное или файл без текстового типа)"""
+    disposition = str(part.get("Content-Disposition", "")).lower()
+    if "attachment" in disposition:
+        return True
+    return part.get_filename() is not None and part.get_content_maintype() != "text"
+
+@functools.lru_cache(maxsize=64)
+def lookup_charset(charset: Optional[str]) -> str:
+    """
+    Каноническое имя кодека для charset из письма (koi8-r, windows-1251, cp866...).
+    Неизвестная или пустая кодировка - UTF-8.
+    """
+    if charset:
+        try:
+            return codecs.lookup(charset.strip().strip('"').lower()).name
+        except LookupError:
+            logger.debug("Неизвестная кодировка %r, используется %s", charset, DEFAULT_CHARSET)
+    return codecs.lookup(DEFAULT_CHARSET).name
+
+def part_charset(part: Message, payload: bytes) -> str:
+    """Кодировка текстовой части: параметр charset, для HTML без него - <meta charset>"""
+    charset = part.get_content_charset()
+    if charset is None and part.get_content_subtype() == "html":
+        match = HTML_META_CHARSET.search(payload[:HTML_META_SCAN_BYTES])
+        if match:
+            charset = match.group(1).decode("ascii")
+    return lookup_charset(charset)
+
+def decode_body(part: Message, max_chars: int) -> Optional[str]:
+    """
+    Декодировать текстовую часть (Content-Transfer-Encoding и charset части),
+    не больше max_chars символов
+    """
+    payload = part.get_payload(decode=True)
+    if not payload:
+        return None
+    # Символ занимает не больше 4 байт - лишнее не декодируем; инкрементальный
+    # декодер не превращает символ, разрезанный на границе, в мусор
+    decoder = codecs.getincrementaldecoder(part_charset(part, payload))(errors="replace")
+    text = decoder.decode(payload[:max_chars * 4], final=len(payload) <= max_chars * 4)
+    if len(text) > max_chars:
+        logger.debug("Тело письма обрезано до %s символов", max_chars)
+        text = text[:max_chars]
+    return text
+
+def decode_header_value(value) -> str:
+    """Декодировать заголовок с encoded-words (RFC 2047) в текст"""
+    if not value:
+        return ""
+    # 8-битный заголовок без кодирования парсер отдаёт объектом Header с unknown-8bit
+    if isinstance(value, str) and "=?" not in value:
+        return value
+    try:
+        return str(make_header([
+            (chunk, lookup_charset(None if charset == "unknown-8bit" else charset) if charset else None)
+            for chunk, charset in decode_header(value)
+        ]))
+    except (LookupError, UnicodeError, ValueError):
+        return str(value)
+
+def spool_attachment(part: Message, spool_dir: Optional[str] = None) -> dict:
+    """
+    Декодировать вложение во временный файл и освободить его копию в памяти.
+    Возвращает описание вложения с путём к файлу и SHA-256 содержимого.
+    """
+    spool_dir = spool_dir or settings.ATTACHMENT_SPOOL_DIR or tempfile.gettempdir()
+    os.makedirs(spool_dir, exist_ok=True)
+    fd, path = tempfile.mkstemp(prefix="atv-attachment-", dir=spool_dir)
+    try:
+        with os.fdopen(fd, "wb") as spool:
+            size, digest = write_decoded_payload(part, spool)
+    except Exception:
+        os.unlink(path)
+        raise
+    attachment = {
+        "filename": part.get_filename(),
+        "content_type": part.get_content_type(),
+        "size": size,
+        "sha256": digest,
+        "path": path,
+    }
+    # Закодированная копия больше не нужна - не держим её до конца обработки письма
+    part.set_payload("")
+    return attachment
+
+def write_decoded_payload(part: Message, out: BinaryIO) -> Tuple[int, str]:
+    """
+    Записать декодированное содержимое части в файл. base64 декодируется
+    порциями, без второй копии вложения целиком. Возвращает размер и SHA-256.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    payload = part.get_payload()
+    if part.get("Content-Transfer-Encoding", "").strip().lower() == "base64" and isinstance(payload, str):
+        try:
+            tail = ""
+            for offset in range(0, len(payload), DECODE_CHUNK_CHARS):
+                chunk = tail + "".join(payload[offset:offset + DECODE_CHUNK_CHARS].split())
+                cut = len(chunk) - len(chunk) % 4
+                chunk, tail = chunk[:cut], chunk[cut:]
+                data = binascii.a2b_base64(chunk)
+                out.write(data)
+                digest.update(data)
+                size += len(data)
+            if tail:
+                # Оборванный конец без выравнивания - дописываем паддинг, как почтовые клиенты
+                data = binascii.a2b_base64(tail + "=" * (-len(tail) % 4))
+                out.write(data)
+                digest.update(data)
+                size += len(data)
+            return size, digest.hexdigest()
+        except (binascii.Error, ValueError):
+            # Повреждённый base64 - декодируем стандартно, как это делает email.message
+            out.seek(0)
+            out.truncate()
+            digest = hashlib.sha256()
+
+    data = part.get_payload(decode=True) or b""
+    out.write(data)
+    digest.update(data)
+    return len(data), digest.hexdigest()
+
+def discard_attachments(attachments: List[dict]):
+    """Удалить временные файлы вложений"""
+    for attachment in attachments:
+        try:
+            os.unlink(attachment["path"])
+        except FileNotFoundError:
+            pass
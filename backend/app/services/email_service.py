@@ -1,23 +1,44 @@
 import secrets
 import string
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+from typing import List
 from ..core.config import settings
 
+ALPHABET = string.ascii_lowercase + string.digits
+LOCAL_PART_LENGTH = 10
+DOMAIN = "temp.atv.local"  # Временный домен
+# Байты не меньше этого значения отбрасываются, чтобы символы алфавита были равновероятны
+UNBIASED_BYTE_LIMIT = 256 - 256 % len(ALPHABET)
+
 def generate_temp_email() -> str:
     """
     Генерация уникального временного email-адреса
     """
     # Генерируем случайную строку
-    alphabet = string.ascii_lowercase + string.digits
-    random_part = ''.join(secrets.choice(alphabet) for _ in range(10))
-    
-    # Используем домен приложения
-    domain = "temp.atv.local"  # Временный домен
+    random_part = ''.join(secrets.choice(ALPHABET) for _ in range(LOCAL_PART_LENGTH))
     
-    return f"{random_part}@{domain}"
+    return f"{random_part}@{DOMAIN}"
+
+def generate_temp_emails(count: int) -> List[str]:
+    """
+    Пакетная генерация временных адресов: случайные байты для всех адресов
+    берутся из ОС одним вызовом, а не отдельным secrets.choice на каждый символ.
+    Адреса внутри пакета не повторяются, поэтому их может быть меньше count.
+    """
+    needed = count * LOCAL_PART_LENGTH
+    chars = []
+    while len(chars) < needed:
+        # С запасом на отброшенные байты (~1.6%)
+        chunk = secrets.token_bytes(needed - len(chars) + needed // 32 + 16)
+        chars.extend(ALPHABET[byte % len(ALPHABET)] for byte in chunk if byte < UNBIASED_BYTE_LIMIT)
+    local_parts = (
+        ''.join(chars[i:i + LOCAL_PART_LENGTH]) for i in range(0, needed, LOCAL_PART_LENGTH)
+    )
+    return list(dict.fromkeys(f"{local_part}@{DOMAIN}" for local_part in local_parts))
 
 def calculate_expiry() -> datetime:
     """
-    Рассчитать время истечения срока действия
+    Рассчитать время истечения срока действия.
+    Время с часовым поясом: asyncpg считает наивное время местным временем хоста
     """
-    return datetime.utcnow() + timedelta(hours=settings.EMAIL_TTL_HOURS)
\ No newline at end of file
+    return datetime.now(timezone.utc) + timedelta(hours=settings.EMAIL_TTL_HOURS)
\ No newline at end of file
@@ -0,0 +1,78 @@
+import html
+import re
+from typing import Iterator, Optional, Tuple
+
+# Код рядом с ключевым словом: "Ваш код: 123456", "verification code is 4821"
+OTP_KEYWORD_CODE = re.compile(
+    r"(?:код|пароль|pin|otp|code|passcode|password|token)\w*\W{1,3}(?:\w+\W{1,3}){0,4}?(\d{4,8})\b",
+    re.IGNORECASE,
+)
+# Без ключевого слова - только отдельно стоящие 6 цифр (не часть телефона или суммы)
+OTP_STANDALONE_CODE = re.compile(r"(?<![\d.,+\-/:])\b(\d{6})\b(?![.,\-/:]?\d)")
+
+# Ссылки в HTML: href тега <a> и текст ссылки
+HTML_LINK = re.compile(r"""<a\s[^>]*?href\s*=\s*["']([^"']+)["'][^>]*>(.*?)</a\s*>""", re.IGNORECASE | re.DOTALL)
+TEXT_LINK = re.compile(r"""https?://[^\s<>"']+""", re.IGNORECASE)
+HTML_TAG = re.compile(r"<[^>]+>")
+HTML_HIDDEN = re.compile(r"<(style|script|head)\b.*?</\1\s*>", re.IGNORECASE | re.DOTALL)
+
+# Признаки ссылки подтверждения в адресе или тексте ссылки
+CONFIRM_LINK_HINT = re.compile(
+    r"confirm|verif|activat|validat|magic|token|reset|password|signup|register|"
+    r"подтверд|активац|актив|регистрац|пароль|войти",
+    re.IGNORECASE,
+)
+# Такие ссылки есть почти в каждом письме, но подтверждением не являются
+IGNORED_LINK_HINT = re.compile(r"unsubscribe|отписат|optout|opt-out|preferences|privacy|mailto:", re.IGNORECASE)
+
+# Просматривается только начало тела: код и ссылка всегда в первых экранах письма
+MAX_SCAN_CHARS = 100_000
+# Длиннее не сохраняем: такая ссылка не поместится в строку индекса
+MAX_LINK_LENGTH = 2048
+
+
+def html_to_text(body_html: str) -> str:
+    """Грубое извлечение текста из HTML для поиска кода"""
+    body_html = HTML_HIDDEN.sub(" ", body_html[:MAX_SCAN_CHARS])
+    return html.unescape(HTML_TAG.sub(" ", body_html))
+
+def extract_code(subject: Optional[str], body_text: Optional[str], body_html: Optional[str]) -> Optional[str]:
+    """Одноразовый код из темы или тела письма"""
+    texts = [subject or ""]
+    if body_text:
+        texts.append(body_text[:MAX_SCAN_CHARS])
+    elif body_html:
+        texts.append(html_to_text(body_html))
+    for pattern in (OTP_KEYWORD_CODE, OTP_STANDALONE_CODE):
+        for text in texts:
+            match = pattern.search(text)
+            if match:
+                return match.group(1)
+    return None
+
+def iter_links(body_text: Optional[str], body_html: Optional[str]) -> Iterator[Tuple[str, str]]:
+    """Ссылки письма: (адрес, текст ссылки) сначала из HTML, затем из текста"""
+    if body_html:
+        for match in HTML_LINK.finditer(body_html[:MAX_SCAN_CHARS]):
+            yield html.unescape(match.group(1)).strip(), HTML_TAG.sub(" ", match.group(2))
+    if body_text:
+        for match in TEXT_LINK.finditer(body_text[:MAX_SCAN_CHARS]):
+            yield match.group(0).rstrip(".,;:!?)]"), ""
+
+def extract_link(body_text: Optional[str], body_html: Optional[str]) -> Optional[str]:
+    """Ссылка подтверждения (регистрации, входа, сброса пароля)"""
+    for url, label in iter_links(body_text, body_html):
+        if not url.lower().startswith(("http://", "https://")) or len(url) > MAX_LINK_LENGTH:
+            continue
+        if IGNORED_LINK_HINT.search(url) or IGNORED_LINK_HINT.search(label):
+            continue
+        if CONFIRM_LINK_HINT.search(url) or CONFIRM_LINK_HINT.search(label):
+            return url
+    return None
+
+def extract_verification(parsed: dict) -> dict:
+    """Код и ссылка подтверждения для результата parse_email_message"""
+    return {
+        "otp_code": extract_code(parsed["subject"], parsed["body_text"], parsed["body_html"]),
+        "confirm_link": extract_link(parsed["body_text"], parsed["body_html"]),
+    }
@@ -0,0 +1,166 @@
+import asyncio
+import logging
+import uuid
+from typing import Optional
+
+from sqlalchemy import func, select, text, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..core.config import settings
+from ..database import AsyncSessionLocal
+from ..models import EmailAccount
+from .email_service import calculate_expiry, generate_temp_emails
+
+logger = logging.getLogger(__name__)
+
+# Ключ advisory lock: пул пополняет только один воркер за раз
+POOL_REFILL_LOCK_KEY = 0x41545650
+
+
+class MailboxPool:
+    """
+    Запас заранее созданных ящиков для быстрого POST /email.
+
+    Ящики пула лежат в email_accounts с pooled = true и без срока действия
+    (сборщик их не трогает, SMTP сервер не принимает на них почту).
+    Создание ящика забирает один из пула одним UPDATE с
+    FOR UPDATE SKIP LOCKED, поэтому параллельные запросы не ждут друг друга.
+    Фоновая задача дополняет пул до target_size порциями не больше
+    refill_batch_size раз в refill_interval_seconds, а если пул опустел
+    наполовину - сразу.
+    """
+    def __init__(self, target_size: int = 100, refill_batch_size: int = 100, refill_interval_seconds: float = 5):
+        self.target_size = target_size
+        self.refill_batch_size = refill_batch_size
+        self.refill_interval_seconds = refill_interval_seconds
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+
+        self.claims = 0
+        self.exhausted = 0
+        self.refilled = 0
+        self.refill_errors = 0
+        self.size = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.target_size > 0
+
+    async def claim(self, db: AsyncSession) -> Optional[EmailAccount]:
+        """
+        Забрать ящик из пула и назначить ему срок действия (фиксирует транзакцию).
+        Возвращает None, если пул пуст - тогда ящик создаётся обычным INSERT.
+        """
+        # Условие "pooled" (а не "pooled IS TRUE") и порядок по id - чтобы
+        # Postgres взял частичный индекс, а не просматривал всю таблицу
+        candidate = select(EmailAccount.id)\
+            .where(EmailAccount.pooled)\
+            .order_by(EmailAccount.id)\
+            .limit(1)\
+            .with_for_update(skip_locked=True)\
+            .scalar_subquery()
+        account = (await db.execute(
+            update(EmailAccount)
+            .where(EmailAccount.id == candidate, EmailAccount.pooled)
+            .values(pooled=False, expires_at=calculate_expiry(), created_at=func.now())
+            .returning(EmailAccount)
+        )).scalars().first()
+        await db.commit()
+
+        if account is None:
+            self.exhausted += 1
+            self._wake()
+            return None
+        self.claims += 1
+        self.size = max(self.size - 1, 0)
+        # Пул наполовину пуст - пополняем, не дожидаясь интервала
+        if self.size < self.target_size // 2:
+            self._wake()
+        return account
+
+    def _wake(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def refill(self) -> int:
+        """Дополнить пул до target_size (не больше refill_batch_size за раз). Возвращает число созданных ящиков"""
+        async with AsyncSessionLocal() as db:
+            locked = (await db.execute(
+                text("SELECT pg_try_advisory_xact_lock(:key)"), {"key": POOL_REFILL_LOCK_KEY}
+            )).scalar()
+            if not locked:
+                return 0
+            self.size = (await db.execute(
+                select(func.count()).select_from(EmailAccount).where(EmailAccount.pooled)
+            )).scalar()
+            missing = min(self.target_size - self.size, self.refill_batch_size)
+            if missing <= 0:
+                return 0
+            rows = [
+                {"id": uuid.uuid4(), "email": email, "is_active": True, "pooled": True}
+                for email in generate_temp_emails(missing)
+            ]
+            created = (await db.execute(
+                insert(EmailAccount)
+                .values(rows)
+                .on_conflict_do_nothing(index_elements=[EmailAccount.email])
+                .returning(EmailAccount.id)
+            )).scalars().all()
+            await db.commit()
+        self.size += len(created)
+        self.refilled += len(created)
+        return len(created)
+
+    async def run_forever(self):
+        """Фоновое пополнение пула в цикле событий воркера"""
+        while True:
+            try:
+                await self.refill()
+            except Exception as e:
+                self.refill_errors += 1
+                logger.error(f"Ошибка пополнения пула ящиков: {str(e)}")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.refill_interval_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    def start(self):
+        """Запустить пополнение пула (вызывается в цикле событий)"""
+        if not self.enabled:
+            return
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self.run_forever())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def stats(self) -> dict:
+        """Метрики пула: размер, выдачи и промахи при пустом пуле"""
+        return {
+            "target_size": self.target_size,
+            "size": self.size,
+            "claims": self.claims,
+            "exhausted": self.exhausted,
+            "refilled": self.refilled,
+            "refill_errors": self.refill_errors,
+        }
+
+
+# Глобальный экземпляр пула
+mailbox_pool = None
+
+def get_mailbox_pool() -> MailboxPool:
+    """Получить глобальный экземпляр пула ящиков"""
+    global mailbox_pool
+    if mailbox_pool is None:
+        mailbox_pool = MailboxPool(
+            target_size=settings.MAILBOX_POOL_SIZE,
+            refill_batch_size=settings.MAILBOX_POOL_REFILL_BATCH_SIZE,
+            refill_interval_seconds=settings.MAILBOX_POOL_REFILL_INTERVAL_SECONDS,
+        )
+    return mailbox_pool
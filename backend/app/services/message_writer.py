@@ -0,0 +1,230 @@
+import asyncio
+import logging
+import uuid
+from collections import Counter
+from typing import List, Optional
+
+from sqlalchemy import BigInteger, insert, text
+from sqlalchemy.dialects.postgresql import UUID
+
+from ..core.config import settings
+from ..database import SessionLocal
+from ..models import EmailAttachment as EmailAttachmentModel, EmailMessage as EmailMessageModel
+from .blob_store import release_blobs, store_attachments
+from .metrics import get_registry
+from .search import search_vector_value
+
+logger = logging.getLogger(__name__)
+
+metrics = get_registry()
+WRITE_SECONDS = metrics.histogram("db_write_duration_seconds", "Запись пакета писем в БД (одна транзакция)")
+BATCH_ROWS = metrics.histogram(
+    "db_write_batch_rows", "Число писем в пакете записи", buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+)
+WRITE_ERRORS = metrics.counter("db_write_errors_total", "Неудачные записи пакетов писем")
+
+BUMP_VERSIONS = text("""
+    UPDATE email_accounts AS a
+    SET message_version = a.message_version + v.n
+    FROM unnest(CAST(:ids AS uuid[]), CAST(:counts AS integer[])) AS v(id, n)
+    WHERE a.id = v.id
+    RETURNING a.id, a.message_version
+""").columns(id=UUID(as_uuid=True), message_version=BigInteger)
+
+
+class MessageWriter:
+    """
+    Пакетная запись входящих писем в БД вне цикла событий SMTP сервера.
+
+    Обработчик кладёт письмо в ограниченную очередь и ждёт, пока пакет
+    с ним будет зафиксирован в БД. Фоновая задача собирает письма в пакеты
+    (не больше batch_size штук или не дольше batch_interval_ms) и пишет
+    каждый пакет одним многострочным INSERT в отдельном потоке.
+
+    Строка письма может содержать ключ "attachments" - описания вложений
+    из parse_email_message; их содержимое копируется в хранилище
+    вложений в той же транзакции. Временные файлы вложений удаляет
+    вызывающий, когда submit завершится.
+    """
+    def __init__(self, queue_size: int = 1000, batch_size: int = 100, batch_interval_ms: int = 50):
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval_ms / 1000
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def _ensure_started(self):
+        """Запустить фоновую задачу записи в текущем цикле событий"""
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done() or self._loop is not loop:
+            self._loop = loop
+            self._queue = asyncio.Queue(maxsize=self.queue_size)
+            self._task = loop.create_task(self._run())
+
+    async def submit(self, rows: List[dict]) -> List[uuid.UUID]:
+        """
+        Поставить письма в очередь на запись и дождаться фиксации пакета.
+        Письма из одного вызова всегда попадают в один пакет.
+        Возвращает ID сохранённых писем в том же порядке; id и seq
+        также проставляются в переданные строки.
+        """
+        self._ensure_started()
+        for row in rows:
+            row.setdefault("id", uuid.uuid4())
+        future = self._loop.create_future()
+        # Если очередь заполнена, обработчик ждёт здесь (обратное давление на SMTP клиента)
+        await self._queue.put((rows, future))
+        return await future
+
+    async def _next_batch(self) -> List[tuple]:
+        """Собрать очередной пакет: ждём первые письма, затем добираем до лимита или таймаута"""
+        batch = [await self._queue.get()]
+        size = len(batch[0][0])
+        deadline = self._loop.time() + self.batch_interval
+        while size < self.batch_size:
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                size += len(batch[-1][0])
+                continue
+            timeout = deadline - self._loop.time()
+            if timeout <= 0:
+                break
+            getter = asyncio.ensure_future(self._queue.get())
+            done, _ = await asyncio.wait({getter}, timeout=timeout)
+            if not done:
+                getter.cancel()
+                await asyncio.wait({getter})
+                if getter.cancelled():
+                    break
+            batch.append(getter.result())
+            size += len(batch[-1][0])
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._next_batch()
+            rows = [row for job_rows, _ in batch for row in job_rows]
+            BATCH_ROWS.observe(len(rows))
+            try:
+                with WRITE_SECONDS.time():
+                    await asyncio.to_thread(self._write_batch, rows)
+            except Exception as e:
+                WRITE_ERRORS.inc()
+                logger.error(f"Ошибка пакетной записи писем ({len(rows)} шт.): {str(e)}")
+                if len(batch) == 1:
+                    self._finish(batch[0], error=e)
+                    continue
+                # Одно неподходящее письмо не должно отклонять весь пакет:
+                # пишем каждое задание отдельно, ошибку получит только виновное
+                for job in batch:
+                    try:
+                        await asyncio.to_thread(self._write_batch, job[0])
+                    except Exception as job_error:
+                        WRITE_ERRORS.inc()
+                        logger.error(f"Ошибка записи письма ({len(job[0])} получ.): {str(job_error)}")
+                        self._finish(job, error=job_error)
+                    else:
+                        self._finish(job)
+                continue
+
+            for job in batch:
+                self._finish(job)
+
+    @staticmethod
+    def _finish(job: tuple, error: Optional[Exception] = None):
+        """Сообщить обработчику результат записи его писем"""
+        job_rows, future = job
+        if future.done():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result([row["id"] for row in job_rows])
+
+    def stats(self) -> dict:
+        """Метрики очереди записи: сколько писем ждут пакета"""
+        return {
+            "queue_size": self.queue_size,
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "batch_size": self.batch_size,
+        }
+
+    @staticmethod
+    def _write_batch(rows: List[dict]):
+        """
+        Записать пакет писем одной транзакцией (выполняется в пуле потоков).
+        Версии ящиков увеличиваются одним UPDATE, и каждое письмо получает
+        свой порядковый номер seq внутри ящика.
+        """
+        counts = Counter(row["email_account_id"] for row in rows)
+        # Блокируем строки ящиков в одном порядке, чтобы параллельные пакеты не ловили deadlock
+        account_ids = sorted(counts, key=str)
+        db = SessionLocal()
+        attachments = []
+        try:
+            versions = dict(db.execute(
+                BUMP_VERSIONS,
+                {
+                    "ids": [str(account_id) for account_id in account_ids],
+                    "counts": [counts[account_id] for account_id in account_ids],
+                }
+            ).all())
+            next_seq = {
+                account_id: versions[account_id] - counts[account_id] + 1
+                for account_id in account_ids if account_id in versions
+            }
+            for row in rows:
+                account_id = row["email_account_id"]
+                if account_id in next_seq:
+                    row["seq"] = next_seq[account_id]
+                    next_seq[account_id] += 1
+                else:
+                    row["seq"] = None
+            attachments = [
+                dict(attachment, message_id=row["id"], email_account_id=row["email_account_id"])
+                for row in rows for attachment in row.get("attachments", ())
+            ]
+            store_attachments(db, attachments)
+            db.execute(
+                # search_vector строится в БД из search_document строки
+                insert(EmailMessageModel).values(search_vector=search_vector_value()),
+                [{key: value for key, value in row.items() if key != "attachments"} for row in rows]
+            )
+            if attachments:
+                db.execute(insert(EmailAttachmentModel), [
+                    {
+                        "id": uuid.uuid4(),
+                        "message_id": attachment["message_id"],
+                        "email_account_id": attachment["email_account_id"],
+                        "filename": attachment["filename"],
+                        "content_type": attachment["content_type"],
+                        "size": attachment["size"],
+                        "sha256": attachment["sha256"],
+                    }
+                    for attachment in attachments
+                ])
+            db.commit()
+        except Exception:
+            db.rollback()
+            if attachments:
+                # Содержимое уже скопировано в хранилище, но ссылки на него не записаны
+                release_blobs(attachment["sha256"] for attachment in attachments)
+            raise
+        finally:
+            db.close()
+
+
+# Глобальный экземпляр очереди записи
+message_writer = None
+
+def get_message_writer() -> MessageWriter:
+    """Получить глобальный экземпляр очереди записи писем"""
+    global message_writer
+    if message_writer is None:
+        message_writer = MessageWriter(
+            queue_size=settings.INGEST_QUEUE_SIZE,
+            batch_size=settings.INGEST_BATCH_SIZE,
+            batch_interval_ms=settings.INGEST_BATCH_INTERVAL_MS,
+        )
+    return message_writer
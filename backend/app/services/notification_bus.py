@@ -0,0 +1,178 @@
+import asyncio
+import json
+import logging
+import select
+import threading
+from abc import ABC, abstractmethod
+from typing import Callable, List, Optional, Tuple
+
+import psycopg2
+import psycopg2.extensions
+from sqlalchemy import text
+from sqlalchemy.engine import make_url
+
+from ..core.config import settings
+from ..database import engine
+
+logger = logging.getLogger(__name__)
+
+Subscriber = Callable[[dict], None]
+
+
+class NotificationBus(ABC):
+    """
+    Шина уведомлений между процессами приложения (SMTP сервер, воркеры uvicorn).
+
+    Подписчик регистрируется вместе со своим циклом событий: событие
+    передаётся в этот цикл через call_soon_threadsafe, поэтому обработчик
+    всегда выполняется в том потоке, которому принадлежат его WebSocket'ы.
+    Подписчик без цикла вызывается сразу в потоке доставки.
+    """
+    def __init__(self):
+        self._subscribers: List[Tuple[Subscriber, Optional[asyncio.AbstractEventLoop]]] = []
+        self._lock = threading.Lock()
+
+    def subscribe(self, callback: Subscriber, loop: Optional[asyncio.AbstractEventLoop] = None):
+        """Подписаться на все события шины"""
+        with self._lock:
+            self._subscribers.append((callback, loop))
+
+    def unsubscribe(self, callback: Subscriber):
+        """Отписаться от событий шины"""
+        with self._lock:
+            self._subscribers = [(cb, loop) for cb, loop in self._subscribers if cb != callback]
+
+    @abstractmethod
+    def publish(self, events: List[dict]):
+        """Опубликовать события (может блокировать, вызывать вне цикла событий)"""
+
+    def start(self):
+        """Запустить доставку событий"""
+
+    def stop(self):
+        """Остановить доставку событий"""
+
+    def _dispatch(self, event: dict):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for callback, loop in subscribers:
+            try:
+                if loop is None:
+                    callback(event)
+                else:
+                    loop.call_soon_threadsafe(callback, event)
+            except Exception as e:
+                logger.error(f"Ошибка доставки события {event.get('type')}: {str(e)}")
+
+
+class InProcessBus(NotificationBus):
+    """
+    Шина внутри одного процесса: SMTP сервер и API запущены вместе
+    """
+    def publish(self, events: List[dict]):
+        for event in events:
+            self._dispatch(event)
+
+
+class PostgresBus(NotificationBus):
+    """
+    Шина на основе Postgres LISTEN/NOTIFY: SMTP сервер и воркеры uvicorn
+    могут работать в разных процессах, дополнительные сервисы не нужны.
+
+    Размер NOTIFY ограничен (~8000 байт), поэтому из слишком больших событий
+    убирается тело письма, а событие помечается как truncated.
+    """
+    MAX_PAYLOAD_BYTES = 7900
+
+    def __init__(self, channel: str = "atv_events", reconnect_delay: float = 1.0):
+        super().__init__()
+        self.channel = channel
+        self.reconnect_delay = reconnect_delay
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+    def publish(self, events: List[dict]):
+        if not events:
+            return
+        with engine.begin() as connection:
+            connection.execute(
+                text("SELECT pg_notify(:channel, :payload)"),
+                [{"channel": self.channel, "payload": self._encode(event)} for event in events]
+            )
+
+    def _encode(self, event: dict) -> str:
+        payload = json.dumps(event)
+        if len(payload.encode("utf-8")) <= self.MAX_PAYLOAD_BYTES or "message" not in event:
+            return payload
+        message = {
+            key: value for key, value in event["message"].items()
+            if key not in ("body_text", "body_html")
+        }
+        payload = json.dumps(dict(event, message=message, truncated=True))
+        if len(payload.encode("utf-8")) <= self.MAX_PAYLOAD_BYTES:
+            return payload
+        # Даже заголовки не помещаются - передаём только ссылку на письмо
+        return json.dumps({key: value for key, value in event.items() if key != "message"} | {"truncated": True})
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._listen_forever, name="notification-bus", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _connect(self):
+        url = make_url(settings.DATABASE_URL).set(drivername="postgresql")
+        connection = psycopg2.connect(url.render_as_string(hide_password=False))
+        connection.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        with connection.cursor() as cursor:
+            cursor.execute(f'LISTEN "{self.channel}"')
+        return connection
+
+    def _listen_forever(self):
+        """Поток, слушающий канал Postgres и раздающий события подписчикам"""
+        while not self._stopped.is_set():
+            connection = None
+            try:
+                connection = self._connect()
+                logger.info(f"Шина уведомлений слушает канал {self.channel}")
+                while not self._stopped.is_set():
+                    if select.select([connection], [], [], 1.0) == ([], [], []):
+                        continue
+                    connection.poll()
+                    while connection.notifies:
+                        notify = connection.notifies.pop(0)
+                        try:
+                            event = json.loads(notify.payload)
+                        except ValueError:
+                            logger.warning(f"Некорректное событие в канале {self.channel}")
+                            continue
+                        self._dispatch(event)
+            except Exception as e:
+                logger.error(f"Ошибка шины уведомлений: {str(e)}")
+                self._stopped.wait(self.reconnect_delay)
+            finally:
+                if connection is not None:
+                    connection.close()
+
+
+# Глобальный экземпляр шины
+notification_bus = None
+
+def get_notification_bus() -> NotificationBus:
+    """Получить глобальный экземпляр шины уведомлений"""
+    global notification_bus
+    if notification_bus is None:
+        if settings.NOTIFICATION_BACKEND == "postgres":
+            notification_bus = PostgresBus(channel=settings.NOTIFICATION_CHANNEL)
+        elif settings.NOTIFICATION_BACKEND == "inprocess":
+            notification_bus = InProcessBus()
+        else:
+            raise ValueError(f"Неизвестный NOTIFICATION_BACKEND: {settings.NOTIFICATION_BACKEND}")
+    return notification_bus
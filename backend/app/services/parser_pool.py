@@ -0,0 +1,123 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+
+from ..core.config import settings
+from .email_parser import parse_email_message
+from .extractors import extract_verification
+from .metrics import get_registry
+from .search import search_document
+
+logger = logging.getLogger(__name__)
+
+PARSE_SECONDS = get_registry().histogram(
+    "parse_duration_seconds", "Разбор письма: inline - в цикле событий SMTP, pool - в пуле процессов", ["mode"]
+)
+
+
+def parse_incoming(raw_message: bytes) -> dict:
+    """
+    Разбор входящего письма вместе с извлечением кода и ссылки подтверждения
+    и подготовкой текста для полнотекстового индекса
+    """
+    parsed = parse_email_message(raw_message)
+    parsed.update(extract_verification(parsed))
+    parsed["search_document"] = search_document(parsed)
+    return parsed
+
+def default_workers() -> int:
+    """Число процессов разбора по числу ядер: одно ядро остаётся циклу событий SMTP"""
+    return max((os.cpu_count() or 1) - 1, 1)
+
+
+class ParserPool:
+    """
+    Разбор входящих писем в пуле процессов.
+
+    Разбор MIME (base64, кодировки, HTML) нагружает процессор и в цикле
+    событий aiosmtpd задерживал бы все остальные SMTP сессии. Письма
+    больше inline_max_bytes разбираются в отдельных процессах: туда
+    передаются исходные байты, обратно - словарь parse_incoming
+    (вложения уже выгружены во временные файлы, передаются только пути).
+    Маленькие письма разбираются на месте - передача в процесс для них
+    дороже самого разбора. workers = 0 - всегда разбирать на месте.
+    """
+    def __init__(self, workers: int, inline_max_bytes: int = 64 * 1024):
+        self.workers = workers
+        self.inline_max_bytes = inline_max_bytes
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+        self.inline = 0
+        self.offloaded = 0
+        self.broken = 0
+        self.offloaded_seconds = 0.0
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # spawn: дочерний процесс не наследует потоки и соединения с БД родителя
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+            )
+            logger.info(f"Пул разбора писем: {self.workers} процессов")
+        return self._executor
+
+    async def parse(self, raw_message: bytes) -> dict:
+        """Разобрать письмо на месте или в пуле процессов (по размеру)"""
+        if self.workers <= 0 or len(raw_message) <= self.inline_max_bytes:
+            self.inline += 1
+            with PARSE_SECONDS.labels("inline").time():
+                return parse_incoming(raw_message)
+
+        started = time.monotonic()
+        try:
+            parsed = await asyncio.get_running_loop().run_in_executor(
+                self._get_executor(), parse_incoming, raw_message
+            )
+        except BrokenProcessPool:
+            # Процесс разбора упал (например, нехватка памяти) - пересоздаём пул, письмо разбираем на месте
+            self.broken += 1
+            logger.error("Пул разбора писем сломан, пересоздаётся")
+            self.shutdown()
+            self.inline += 1
+            return parse_incoming(raw_message)
+        elapsed = time.monotonic() - started
+        self.offloaded += 1
+        self.offloaded_seconds += elapsed
+        PARSE_SECONDS.labels("pool").observe(elapsed)
+        return parsed
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def stats(self) -> dict:
+        """Метрики пула: сколько писем разобрано на месте и в процессах"""
+        return {
+            "workers": self.workers,
+            "inline_max_bytes": self.inline_max_bytes,
+            "inline": self.inline,
+            "offloaded": self.offloaded,
+            "broken": self.broken,
+            "offloaded_avg_ms": round(self.offloaded_seconds / self.offloaded * 1000, 2) if self.offloaded else 0.0,
+        }
+
+
+# Глобальный экземпляр пула
+parser_pool = None
+
+def get_parser_pool() -> ParserPool:
+    """Получить глобальный экземпляр пула разбора писем"""
+    global parser_pool
+    if parser_pool is None:
+        workers = settings.PARSER_WORKERS.strip().lower()
+        parser_pool = ParserPool(
+            workers=default_workers() if workers in ("", "auto") else int(workers),
+            inline_max_bytes=settings.PARSER_INLINE_MAX_BYTES,
+        )
+    return parser_pool
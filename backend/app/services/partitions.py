@@ -0,0 +1,150 @@
+import logging
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Dict, List
+
+from sqlalchemy import text
+
+from ..core.config import settings
+
+logger = logging.getLogger(__name__)
+
+PARENT_TABLE = "email_messages"
+DEFAULT_PARTITION = "email_messages_default"
+PARTITION_PREFIX = "email_messages_p"
+
+IS_PARTITIONED = text("SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass(:table)")
+
+LIST_PARTITIONS = text("""
+    SELECT c.relname FROM pg_inherits AS i
+    JOIN pg_class AS c ON c.oid = i.inhrelid
+    WHERE i.inhparent = to_regclass(:table)
+""")
+
+
+def partition_name(day: date) -> str:
+    return f"{PARTITION_PREFIX}{day:%Y%m%d}"
+
+def day_start(day: date) -> datetime:
+    return datetime.combine(day, time.min, tzinfo=timezone.utc)
+
+
+class PartitionManager:
+    """
+    Суточные секции таблицы email_messages, разбитой по received_at
+    (см. migrations/partitioned.sql).
+
+    Секции создаются заранее на premake_days дней вперёд, а секции, все
+    письма которых старше retention_hours, удаляются целиком через DROP
+    TABLE - без построчного DELETE, раздувания таблицы и нагрузки на
+    VACUUM. Письма вне созданных секций попадают в секцию по умолчанию и
+    переносятся в свою секцию при её создании.
+    """
+    def __init__(self, premake_days: int = 3, retention_hours: int = 24):
+        self.premake_days = premake_days
+        self.retention_hours = retention_hours
+        self.partitions_created = 0
+        self.partitions_dropped = 0
+
+    @staticmethod
+    def is_partitioned(connection) -> bool:
+        """Разбита ли таблица писем на секции в этой базе"""
+        partitioned = connection.execute(IS_PARTITIONED, {"table": PARENT_TABLE}).scalar()
+        connection.commit()
+        return bool(partitioned)
+
+    @staticmethod
+    def existing(connection) -> Dict[date, str]:
+        """Суточные секции: {день: имя таблицы}"""
+        partitions = {}
+        for (name,) in connection.execute(LIST_PARTITIONS, {"table": PARENT_TABLE}):
+            if name.startswith(PARTITION_PREFIX):
+                try:
+                    partitions[datetime.strptime(name[len(PARTITION_PREFIX):], "%Y%m%d").date()] = name
+                except ValueError:
+                    continue
+        connection.commit()
+        return partitions
+
+    def create_partition(self, connection, day: date) -> str:
+        """
+        Создать секцию на сутки day. Письма этих суток, уже попавшие
+        в секцию по умолчанию, переносятся в новую секцию в той же транзакции.
+        """
+        name = partition_name(day)
+        bounds = {"lower": day_start(day), "upper": day_start(day + timedelta(days=1))}
+        connection.execute(text(
+            f'CREATE TABLE "{name}" (LIKE {PARENT_TABLE} INCLUDING DEFAULTS INCLUDING CONSTRAINTS INCLUDING STORAGE)'
+        ))
+        connection.execute(text(f"""
+            WITH moved AS (
+                DELETE FROM {DEFAULT_PARTITION}
+                WHERE received_at >= :lower AND received_at < :upper
+                RETURNING *
+            )
+            INSERT INTO "{name}" SELECT * FROM moved
+        """), bounds)
+        # Границы секции - литералы DDL, параметры здесь недоступны
+        connection.execute(text(
+            f"""ALTER TABLE {PARENT_TABLE} ATTACH PARTITION "{name}" """
+            f"""FOR VALUES FROM ('{bounds["lower"].isoformat()}') TO ('{bounds["upper"].isoformat()}')"""
+        ))
+        connection.commit()
+        self.partitions_created += 1
+        return name
+
+    def ensure_partitions(self, connection, today: date) -> List[str]:
+        """Создать недостающие секции с сегодняшнего дня на premake_days вперёд"""
+        partitions = self.existing(connection)
+        created = []
+        for offset in range(self.premake_days + 1):
+            day = today + timedelta(days=offset)
+            if day not in partitions:
+                created.append(self.create_partition(connection, day))
+        return created
+
+    def drop_expired(self, connection, now: datetime) -> List[str]:
+        """Удалить секции, в которых все письма старше срока хранения"""
+        cutoff = now - timedelta(hours=self.retention_hours)
+        dropped = []
+        for day, name in sorted(self.existing(connection).items()):
+            if day_start(day + timedelta(days=1)) > cutoff:
+                break
+            connection.execute(text(f'DROP TABLE "{name}"'))
+            connection.commit()
+            self.partitions_dropped += 1
+            dropped.append(name)
+        # Секцию по умолчанию удалить нельзя - просроченные письма в ней чистим построчно
+        connection.execute(text(f"DELETE FROM {DEFAULT_PARTITION} WHERE received_at < :cutoff"), {"cutoff": cutoff})
+        connection.commit()
+        return dropped
+
+    def maintain(self, connection) -> dict:
+        """Один проход обслуживания: создать будущие секции и удалить устаревшие"""
+        now = datetime.now(timezone.utc)
+        created = self.ensure_partitions(connection, now.date())
+        dropped = self.drop_expired(connection, now)
+        if created or dropped:
+            logger.info(f"Секции писем: создано {created}, удалено {dropped}")
+        return {"created": created, "dropped": dropped}
+
+    def stats(self) -> dict:
+        return {
+            "partitions_created": self.partitions_created,
+            "partitions_dropped": self.partitions_dropped,
+            "premake_days": self.premake_days,
+            "retention_hours": self.retention_hours,
+        }
+
+
+# Глобальный экземпляр менеджера секций
+partition_manager = None
+
+def get_partition_manager() -> PartitionManager:
+    """Получить глобальный экземпляр менеджера секций таблицы писем"""
+    global partition_manager
+    if partition_manager is None:
+        partition_manager = PartitionManager(
+            premake_days=settings.MESSAGE_PARTITION_PREMAKE_DAYS,
+            retention_hours=settings.EMAIL_TTL_HOURS,
+        )
+    return partition_manager
@@ -0,0 +1,88 @@
+import asyncio
+import gzip
+import logging
+import zlib
+from typing import Iterator, Optional, Tuple
+
+from .. import schemas
+from ..core.config import settings
+from .email_parser import parse_email_message
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+# Порция распакованного письма при потоковой отдаче
+RAW_CHUNK_SIZE = 64 * 1024
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+_fallback_logged = False
+
+
+def archive_encoding() -> Optional[str]:
+    """
+    Способ сжатия исходных писем по настройке RAW_MESSAGE_STORAGE
+    (None - архив выключен и тела писем хранятся раскодированными).
+    Без пакета zstandard вместо zstd используется gzip.
+    """
+    global _fallback_logged
+    encoding = settings.RAW_MESSAGE_STORAGE.strip().lower() or None
+    if encoding == "zstd" and zstandard is None:
+        if not _fallback_logged:
+            logger.warning("Пакет zstandard не установлен, исходные письма сжимаются gzip")
+            _fallback_logged = True
+        return "gzip"
+    if encoding not in (None, "gzip", "zstd"):
+        raise ValueError(f"Неизвестный RAW_MESSAGE_STORAGE: {settings.RAW_MESSAGE_STORAGE}")
+    return encoding
+
+def compress_raw(data: bytes, encoding: str) -> bytes:
+    """Сжать исходное письмо (RFC 822) для хранения в email_messages.raw_message"""
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    if encoding == "gzip":
+        return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+    raise ValueError(f"Неизвестный способ сжатия: {encoding}")
+
+def iter_raw(data: bytes, encoding: str, chunk_size: int = RAW_CHUNK_SIZE) -> Iterator[bytes]:
+    """Распаковывать исходное письмо порциями, не держа его в памяти целиком"""
+    if encoding == "zstd":
+        if zstandard is None:
+            raise RuntimeError("Для чтения письма нужен пакет zstandard")
+        decompressor = zstandard.ZstdDecompressor().decompressobj()
+    elif encoding == "gzip":
+        decompressor = zlib.decompressobj(wbits=16 + zlib.MAX_WBITS)
+    else:
+        raise ValueError(f"Неизвестный способ сжатия: {encoding}")
+    for offset in range(0, len(data), chunk_size):
+        chunk = decompressor.decompress(data[offset:offset + chunk_size])
+        if chunk:
+            yield chunk
+    tail = decompressor.flush()
+    if tail:
+        yield tail
+
+def decompress_raw(data: bytes, encoding: str) -> bytes:
+    return b"".join(iter_raw(data, encoding))
+
+def decode_bodies(data: bytes, encoding: str) -> Tuple[Optional[str], Optional[str]]:
+    """Раскодировать текст и HTML из сжатого исходного письма (вложения пропускаются)"""
+    parsed = parse_email_message(decompress_raw(data, encoding), with_attachments=False)
+    return parsed["body_text"], parsed["body_html"]
+
+async def render_message(message) -> schemas.EmailMessage:
+    """
+    Письмо для ответа API. Если тела хранятся только в сжатом исходном
+    письме, они раскодируются сейчас, в пуле потоков (ORM объект не меняется).
+    Для этого raw_message должен быть загружен: undefer(EmailMessage.raw_message).
+    """
+    result = schemas.EmailMessage.model_validate(message)
+    if message.raw_message is not None and result.body_text is None and result.body_html is None:
+        result.body_text, result.body_html = await asyncio.to_thread(
+            decode_bodies, message.raw_message, message.raw_encoding
+        )
+    return result
@@ -0,0 +1,260 @@
+import argparse
+import asyncio
+import logging
+import time
+from typing import List, Optional
+
+from sqlalchemy import text
+
+from ..core.config import settings
+from ..core.logging_config import setup_logging
+from ..database import engine
+from .blob_store import release_blobs
+from .notification_bus import get_notification_bus
+from .partitions import PartitionManager, get_partition_manager
+
+logger = logging.getLogger(__name__)
+
+# Ключ advisory lock: в кластере одновременно работает только один сборщик
+REAPER_LOCK_KEY = 0x41545652
+
+SELECT_EXPIRED = text("""
+    SELECT id FROM email_accounts
+    WHERE expires_at < now()
+    ORDER BY expires_at
+    LIMIT :limit
+""")
+
+DELETE_MESSAGES = text("""
+    DELETE FROM email_messages
+    WHERE id IN (
+        SELECT id FROM email_messages
+        WHERE email_account_id = ANY(CAST(:ids AS uuid[]))
+        LIMIT :limit
+    )
+""")
+
+DELETE_ATTACHMENTS = text("""
+    DELETE FROM email_attachments
+    WHERE id IN (
+        SELECT id FROM email_attachments
+        WHERE email_account_id = ANY(CAST(:ids AS uuid[]))
+        LIMIT :limit
+    )
+    RETURNING sha256
+""")
+
+# Ящик, в который успело прийти новое письмо, останется до следующего прохода
+DELETE_ACCOUNTS = text("""
+    DELETE FROM email_accounts AS a
+    WHERE a.id = ANY(CAST(:ids AS uuid[]))
+      AND a.expires_at < now()
+      AND NOT EXISTS (SELECT 1 FROM email_messages AS m WHERE m.email_account_id = a.id)
+    RETURNING a.email
+""")
+
+# При секционированной таблице писем письма удаляются вместе с секциями
+DELETE_ACCOUNTS_ONLY = text("""
+    DELETE FROM email_accounts
+    WHERE id = ANY(CAST(:ids AS uuid[])) AND expires_at < now()
+    RETURNING email
+""")
+
+COUNT_EXPIRED = text("SELECT count(*) FROM email_accounts WHERE expires_at < now()")
+
+
+class MailboxReaper:
+    """
+    Удаление просроченных почтовых ящиков вместе с письмами и вложениями.
+
+    Просроченные ящики выбираются по индексу на expires_at пачками по
+    batch_size, их письма удаляются транзакциями не больше
+    message_batch_size строк, поэтому сборщик не держит долгих блокировок
+    и не раздувает WAL одной огромной транзакцией. Удалённые адреса
+    сбрасываются в кэше SMTP сервера через шину уведомлений, содержимое
+    вложений без оставшихся ссылок удаляется из хранилища.
+
+    Если таблица писем разбита на суточные секции (partition_manager),
+    письма построчно не удаляются: сборщик удаляет только ящики, а
+    менеджер секций - устаревшие секции целиком.
+    """
+    def __init__(self, batch_size: int = 500, message_batch_size: int = 5000, interval_seconds: float = 60,
+                 partition_manager: Optional[PartitionManager] = None):
+        self.batch_size = batch_size
+        self.message_batch_size = message_batch_size
+        self.interval_seconds = interval_seconds
+        self.partition_manager = partition_manager
+        self._task: Optional[asyncio.Task] = None
+
+        self.runs = 0
+        self.skipped_runs = 0
+        self.accounts_deleted = 0
+        self.messages_deleted = 0
+        self.errors = 0
+        self.backlog = 0
+        self.last_run_at: Optional[float] = None
+        self.last_run_seconds = 0.0
+        self.last_run_accounts = 0
+        self.last_run_messages = 0
+
+    def run_once(self) -> dict:
+        """
+        Один проход сборщика (блокирует, вызывать вне цикла событий).
+        Возвращает число удалённых ящиков и писем за проход.
+        """
+        started = time.monotonic()
+        accounts = messages = 0
+        with engine.connect() as connection:
+            locked = connection.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": REAPER_LOCK_KEY}).scalar()
+            connection.commit()
+            if not locked:
+                # Проход уже выполняет другой процесс
+                self.skipped_runs += 1
+                return {"accounts": 0, "messages": 0, "skipped": True}
+            try:
+                partitioned = self.partition_manager is not None and self.partition_manager.is_partitioned(connection)
+                if partitioned:
+                    self.partition_manager.maintain(connection)
+                while True:
+                    ids = [str(row[0]) for row in connection.execute(SELECT_EXPIRED, {"limit": self.batch_size})]
+                    connection.commit()
+                    if not ids:
+                        break
+                    self._delete_attachments(connection, ids)
+                    if partitioned:
+                        emails = connection.execute(DELETE_ACCOUNTS_ONLY, {"ids": ids}).scalars().all()
+                    else:
+                        messages += self._delete_messages(connection, ids)
+                        emails = connection.execute(DELETE_ACCOUNTS, {"ids": ids}).scalars().all()
+                    connection.commit()
+                    accounts += len(emails)
+                    self._invalidate(emails)
+                    if not emails or len(ids) < self.batch_size:
+                        break
+                self.backlog = connection.execute(COUNT_EXPIRED).scalar()
+                connection.commit()
+            finally:
+                connection.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": REAPER_LOCK_KEY})
+                connection.commit()
+
+        self.runs += 1
+        self.accounts_deleted += accounts
+        self.messages_deleted += messages
+        self.last_run_at = time.time()
+        self.last_run_seconds = time.monotonic() - started
+        self.last_run_accounts = accounts
+        self.last_run_messages = messages
+        if accounts or messages:
+            logger.info(
+                f"Сборщик удалил {accounts} ящиков и {messages} писем "
+                f"за {self.last_run_seconds:.2f} с, в очереди {self.backlog}"
+            )
+        return {"accounts": accounts, "messages": messages, "skipped": False}
+
+    def _delete_messages(self, connection, ids: List[str]) -> int:
+        """Удалить письма ящиков ограниченными транзакциями"""
+        deleted = 0
+        while True:
+            count = connection.execute(DELETE_MESSAGES, {"ids": ids, "limit": self.message_batch_size}).rowcount
+            connection.commit()
+            deleted += count
+            if count < self.message_batch_size:
+                return deleted
+
+    def _delete_attachments(self, connection, ids: List[str]):
+        """Удалить строки вложений ящиков и освободить содержимое без ссылок"""
+        while True:
+            hashes = connection.execute(DELETE_ATTACHMENTS, {"ids": ids, "limit": self.message_batch_size}).scalars().all()
+            connection.commit()
+            if hashes:
+                release_blobs(hashes)
+            if len(hashes) < self.message_batch_size:
+                return
+
+    @staticmethod
+    def _invalidate(emails: List[str]):
+        if not emails:
+            return
+        try:
+            get_notification_bus().publish([{"type": "address_invalidated", "email": email} for email in emails])
+        except Exception as e:
+            logger.error(f"Ошибка сброса адресов удалённых ящиков: {str(e)}")
+
+    async def run_forever(self):
+        """Периодический запуск сборщика в цикле событий процесса"""
+        while True:
+            try:
+                await asyncio.to_thread(self.run_once)
+            except Exception as e:
+                self.errors += 1
+                logger.error(f"Ошибка сборщика просроченных ящиков: {str(e)}")
+            await asyncio.sleep(self.interval_seconds)
+
+    def start(self):
+        """Запустить периодический сборщик (вызывается в цикле событий)"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self.run_forever())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def stats(self) -> dict:
+        """Метрики сборщика: пропускная способность и число ожидающих удаления ящиков"""
+        throughput = 0.0
+        if self.last_run_seconds > 0:
+            throughput = (self.last_run_accounts + self.last_run_messages) / self.last_run_seconds
+        stats = {
+            "runs": self.runs,
+            "skipped_runs": self.skipped_runs,
+            "errors": self.errors,
+            "accounts_deleted": self.accounts_deleted,
+            "messages_deleted": self.messages_deleted,
+            "backlog": self.backlog,
+            "last_run_at": self.last_run_at,
+            "last_run_seconds": round(self.last_run_seconds, 3),
+            "last_run_rows_per_second": round(throughput, 1),
+            "interval_seconds": self.interval_seconds,
+        }
+        if self.partition_manager is not None:
+            stats["partitions"] = self.partition_manager.stats()
+        return stats
+
+
+# Глобальный экземпляр сборщика
+reaper = None
+
+def get_reaper() -> MailboxReaper:
+    """Получить глобальный экземпляр сборщика просроченных ящиков"""
+    global reaper
+    if reaper is None:
+        reaper = MailboxReaper(
+            batch_size=settings.REAPER_BATCH_SIZE,
+            message_batch_size=settings.REAPER_MESSAGE_BATCH_SIZE,
+            interval_seconds=settings.REAPER_INTERVAL_SECONDS,
+            partition_manager=get_partition_manager() if settings.MESSAGE_PARTITIONING else None,
+        )
+    return reaper
+
+def main():
+    """Запуск сборщика отдельным процессом (например, из cron с --once)"""
+    parser = argparse.ArgumentParser(description="Удаление просроченных временных ящиков")
+    parser.add_argument("--once", action="store_true", help="выполнить один проход и выйти")
+    args = parser.parse_args()
+
+    setup_logging()
+    reaper = get_reaper()
+    try:
+        if args.once:
+            result = reaper.run_once()
+            logger.info(f"Удалено ящиков: {result['accounts']}, писем: {result['messages']}, в очереди: {reaper.backlog}")
+        else:
+            asyncio.run(reaper.run_forever())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        get_notification_bus().stop()
+
+if __name__ == "__main__":
+    main()
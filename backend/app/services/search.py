@@ -0,0 +1,39 @@
+from sqlalchemy import bindparam, func, or_
+
+from ..core.config import settings
+from ..models import EmailMessage
+from .extractors import html_to_text
+
+# В поисковый документ попадает только начало тела: tsvector ограничен 1 МБ,
+# а совпадения в хвосте длинной рассылки никому не нужны
+SEARCH_MAX_BODY_CHARS = 100_000
+
+
+def search_document(parsed: dict) -> str:
+    """Текст для полнотекстового индекса: тема и тело (HTML - без тегов)"""
+    body = parsed["body_text"]
+    if body is None and parsed["body_html"]:
+        body = html_to_text(parsed["body_html"])
+    return "\n".join(filter(None, [parsed["subject"], (body or "")[:SEARCH_MAX_BODY_CHARS]]))
+
+def search_vector_value():
+    """
+    Значение search_vector для INSERT писем: строится в БД из параметра
+    search_document каждой строки (тела в таблице может не быть - архив писем)
+    """
+    return func.to_tsvector(settings.SEARCH_TS_CONFIG, bindparam("search_document"))
+
+def search_condition(query: str):
+    """
+    Условие поиска: полнотекстовое совпадение по теме и телу (GIN индекс
+    search_vector) или подстрока в отправителе или теме (триграммные индексы)
+    """
+    pattern = f"%{escape_like(query)}%"
+    return or_(
+        EmailMessage.search_vector.op("@@")(func.websearch_to_tsquery(settings.SEARCH_TS_CONFIG, query)),
+        EmailMessage.sender.ilike(pattern, escape="\\"),
+        EmailMessage.subject.ilike(pattern, escape="\\"),
+    )
+
+def escape_like(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
@@ -1,110 +1,247 @@
 import asyncio
 import logging
+import threading
+import time
 from aiosmtpd.controller import Controller
-from aiosmtpd.handlers import Message
-from email.message import EmailMessage
+from aiosmtpd.smtp import SMTP, Envelope, Session as SMTPSession
+from sqlalchemy import func, literal, or_, select
+from sqlalchemy.dialects.postgresql import ARRAY
 from sqlalchemy.orm import Session
-from datetime import datetime
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
 
+from ..core.config import settings
+from ..core.logging_config import sampled, setup_logging
 from ..database import SessionLocal
-from ..models import EmailAccount, EmailMessage as EmailMessageModel
-from .email_parser import parse_email_message
-import sys
-import os
-
-# Добавляем путь для импорта
-sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ..models import EmailAccount
+from .address_index import get_address_index
+from .email_parser import discard_attachments
+from .message_writer import get_message_writer
+from .metrics import SIZE_BUCKETS, get_registry, start_metrics_server
+from .notification_bus import get_notification_bus
+from .parser_pool import get_parser_pool
+from .raw_archive import archive_encoding, compress_raw
 
 logger = logging.getLogger(__name__)
 
-# Глобальный словарь для хранения WebSocket соединений
-websocket_connections = {}
+metrics = get_registry()
+SMTP_SESSIONS = metrics.counter("smtp_sessions_total", "SMTP соединения")
+SMTP_SESSIONS_ACTIVE = metrics.gauge("smtp_sessions_active", "Открытые SMTP соединения")
+SMTP_MESSAGES = metrics.counter("smtp_messages_total", "Письма (DATA) по коду ответа", ["code"])
+SMTP_MESSAGE_SIZE = metrics.histogram("smtp_message_size_bytes", "Размер входящего письма", buckets=SIZE_BUCKETS)
+SMTP_RECIPIENTS = metrics.counter("smtp_recipients_total", "Получатели из конверта: found / missing", ["result"])
+SMTP_DATA_SECONDS = metrics.histogram("smtp_data_duration_seconds", "Обработка письма от DATA до ответа")
+
+# Длина колонок sender и recipient (String(255))
+ADDRESS_MAX_LENGTH = 255
+
+def db_text(value: Optional[str], max_length: Optional[int] = None) -> Optional[str]:
+    """Значение для текстовой колонки: без NUL (Postgres его не принимает) и не длиннее колонки"""
+    if value is None:
+        return None
+    return value.replace("\x00", "")[:max_length]
+
+def normalize_address(address: str) -> str:
+    """Привести адрес получателя к виду, в котором он хранится в БД"""
+    return address.strip().strip("<>").strip().lower()
+
+def find_accounts(addresses: List[str]) -> Dict[str, Tuple[object, Optional[datetime]]]:
+    """
+    Найти действующие почтовые ящики для всех адресов одним запросом
+    (выполняется в пуле потоков).
+    Возвращает {email: (account_id, expires_at)}
+    """
+    db: Session = SessionLocal()
+    try:
+        rows = db.execute(
+            select(EmailAccount.email, EmailAccount.id, EmailAccount.expires_at).where(
+                EmailAccount.email == literal(addresses, ARRAY(EmailAccount.email.type)).any_(),
+                # Ящики пула ещё никому не выданы
+                EmailAccount.pooled.is_(False),
+                # Просроченный ящик не принимает письма и до того, как его удалит сборщик
+                or_(EmailAccount.expires_at.is_(None), EmailAccount.expires_at > func.now()),
+            )
+        ).all()
+        return {email: (account_id, expires_at) for email, account_id, expires_at in rows}
+    finally:
+        db.close()
+
+async def resolve_recipients(recipients: List[str]) -> Dict[str, object]:
+    """
+    Найти ID ящиков для адресов получателей: сначала в кэше адресов,
+    оставшиеся - одним запросом к БД
+    """
+    index = get_address_index()
+    accounts, unknown = index.lookup(recipients)
+    if unknown:
+        loaded = await asyncio.to_thread(find_accounts, unknown)
+        # Ящик, истёкший между запросом и этой проверкой, тоже считается отсутствующим
+        accounts.update(index.store(loaded, [rcpt for rcpt in unknown if rcpt not in loaded]))
+    return accounts
 
-class EmailHandler(Message):
+class EmailHandler:
     """
-    Обработчик входящих SMTP сообщений
+    Обработчик входящих SMTP сообщений.
+
+    Письмо разбирается один раз, все получатели из конверта (RCPT TO)
+    ищутся одним запросом, а копии для найденных ящиков записываются
+    одним INSERT через очередь пакетной записи.
     """
-    async def handle_message(self, message: EmailMessage):
+    async def handle_DATA(self, server: SMTP, session: SMTPSession, envelope: Envelope) -> str:
+        started = time.perf_counter()
+        SMTP_MESSAGE_SIZE.observe(len(envelope.content))
+        reply = await self.process(envelope)
+        SMTP_MESSAGES.labels(reply[:3]).inc()
+        SMTP_DATA_SECONDS.observe(time.perf_counter() - started)
+        return reply
+
+    async def process(self, envelope: Envelope) -> str:
         try:
-            # Получаем получателя
-            recipient = message.get("To", "")
-            print(f"🔍 [DEBUG] Получено письмо. Кому: {recipient}")  # <-- ОТЛАДКА УДАЛИТЬ
-            if not recipient:
-                logger.warning("Получено письмо без получателя")
-                return
-            
-            # Извлекаем email адрес из формата "Name <email@domain.com>"
-            recipient_email = recipient
-            if "<" in recipient and ">" in recipient:
-                recipient_email = recipient.split("<")[1].split(">")[0].strip()
-
-            print(f"🔍 [DEBUG] Извлечённый email: {recipient_email}")  # <-- ОТЛАДКА УДАЛИТЬ
-            
-            db: Session = SessionLocal()
+            started = time.perf_counter()
+            recipients = list(dict.fromkeys(normalize_address(rcpt) for rcpt in envelope.rcpt_tos))
+            logger.debug("Получено письмо", extra=sampled(
+                mail_from=envelope.mail_from, recipients=recipients, size=len(envelope.content)
+            ))
+
+            # Запросы к БД выполняем вне цикла событий, чтобы не блокировать другие SMTP сессии
+            accounts = await resolve_recipients(recipients)
+            missing = [rcpt for rcpt in recipients if rcpt not in accounts]
+            SMTP_RECIPIENTS.labels("found").inc(len(accounts))
+            SMTP_RECIPIENTS.labels("missing").inc(len(missing))
+            if missing:
+                logger.warning("Получено письмо на несуществующие ящики: %s", missing, extra={"recipients": missing})
+            if not accounts:
+                return "250 OK"
+
+            # Парсим сообщение один раз для всех получателей (большие письма - в пуле процессов)
+            parse_started = time.perf_counter()
+            parsed = await get_parser_pool().parse(envelope.content)
+            parse_ms = round((time.perf_counter() - parse_started) * 1000, 2)
             try:
-                # Ищем почтовый ящик
-                account = db.query(EmailAccount).filter(
-                    EmailAccount.email == recipient_email
-                ).first()
-                
-                if not account:
-                    print(f"⚠️ [DEBUG] Ящик НЕ НАЙДЕН: {recipient_email}")  # <-- ОТЛАДКА УДАЛИТЬ
-                    logger.warning(f"Получено письмо на несуществующий ящик: {recipient_email}")
-                    return
-                
-                print(f"✅ [DEBUG] Ящик найден! ID: {account.id}")  # <-- ОТЛАДКА УДАЛИТЬ
-
-                # Конвертируем EmailMessage в bytes для парсинга
-                raw_message = bytes(message.as_string(), encoding='utf-8')
-                
-                # Парсим сообщение
-                parsed = parse_email_message(raw_message)
-                
-                # Сохраняем в БД
-                db_message = EmailMessageModel(
-                    email_account_id=account.id,
-                    sender=parsed["sender"],
-                    recipient=parsed["recipient"],
-                    subject=parsed["subject"],
-                    body_text=parsed["body_text"],
-                    body_html=parsed["body_html"],
-                    received_at=parsed["received_at"] or datetime.utcnow()
-                )
-                
-                db.add(db_message)
-                db.commit()
-                db.refresh(db_message)
-
-                print(f"💾 [DEBUG] Письмо сохранено! ID: {db_message.id}")  # <-- ОТЛАДКА УДАЛИТЬ
-                logger.info(f"Сообщение сохранено: {db_message.id} для {recipient_email}")
-                
-                # Отправляем уведомление через WebSocket, если есть подключение
-                await notify_websocket_clients(account.id, db_message.id)
-                
-            except Exception as e:
-                logger.error(f"Ошибка при сохранении письма: {str(e)}")
-                db.rollback()
+                if settings.MESSAGE_PARTITIONING:
+                    # received_at - ключ секции: берём время получения, а не заголовок Date отправителя
+                    received_at = datetime.now(timezone.utc)
+                else:
+                    received_at = parsed["received_at"] or datetime.now(timezone.utc)
+                    if received_at.tzinfo is None:
+                        # Date с зоной -0000 разбирается в наивное время; по RFC 5322 это UTC
+                        received_at = received_at.replace(tzinfo=timezone.utc)
+                sender = parsed["sender"] or envelope.mail_from
+
+                # Архив исходных писем: тела в БД не пишутся, а раскодируются при запросе письма
+                raw_encoding = archive_encoding()
+                raw_message = None
+                if raw_encoding:
+                    raw_message = await asyncio.to_thread(compress_raw, envelope.content, raw_encoding)
+                body_text = parsed["body_text"] if raw_message is None else None
+                body_html = parsed["body_html"] if raw_message is None else None
+
+                for attachment in parsed["attachments"]:
+                    attachment["filename"] = db_text(attachment["filename"])
+                    attachment["content_type"] = db_text(attachment["content_type"], ADDRESS_MAX_LENGTH)
+                rows = [
+                    {
+                        "email_account_id": accounts[rcpt],
+                        "sender": db_text(sender, ADDRESS_MAX_LENGTH),
+                        "recipient": db_text(rcpt, ADDRESS_MAX_LENGTH),
+                        "subject": db_text(parsed["subject"]),
+                        "body_text": db_text(body_text),
+                        "body_html": db_text(body_html),
+                        "received_at": received_at,
+                        "otp_code": parsed["otp_code"],
+                        "confirm_link": db_text(parsed["confirm_link"]),
+                        "search_document": db_text(parsed["search_document"]),
+                        "raw_message": raw_message,
+                        "raw_encoding": raw_encoding if raw_message is not None else None,
+                        "attachments": parsed["attachments"],
+                    }
+                    for rcpt in recipients if rcpt in accounts
+                ]
+
+                # Ставим в очередь пакетной записи и ждём фиксации пакета:
+                # ответ SMTP клиенту уходит только после того, как письмо сохранено
+                write_started = time.perf_counter()
+                try:
+                    message_ids = await get_message_writer().submit(rows)
+                except Exception as e:
+                    logger.error(f"Ошибка при сохранении письма: {str(e)}", extra={"recipients": recipients})
+                    # Ящик мог быть удалён в другом процессе - при повторе адреса проверятся заново
+                    for row in rows:
+                        get_address_index().invalidate(row["recipient"])
+                    # Временная ошибка: отправитель повторит доставку позже
+                    return "451 Requested action aborted: local error in processing"
+
+                write_ms = round((time.perf_counter() - write_started) * 1000, 2)
+                for row, message_id in zip(rows, message_ids):
+                    logger.info("Сообщение сохранено", extra=sampled(
+                        message_id=str(message_id), recipient=row["recipient"], size=len(envelope.content),
+                        parse_ms=parse_ms, write_ms=write_ms,
+                        total_ms=round((time.perf_counter() - started) * 1000, 2),
+                    ))
+
+                # Уведомляем WebSocket клиентов через шину уведомлений
+                await notify_new_messages(rows, message_ids, parsed)
+                return "250 OK"
             finally:
-                db.close()
-                
+                # Письмо записано (содержимое вложений уже в хранилище) или отклонено - временные файлы больше не нужны
+                discard_attachments(parsed["attachments"])
+
         except Exception as e:
-            logger.error(f"Ошибка обработки письма: {str(e)}")
+            logger.exception(f"Ошибка обработки письма: {str(e)}")
+            return "451 Requested action aborted: local error in processing"
 
-async def notify_websocket_clients(email_account_id, message_id):
+async def notify_new_messages(rows: List[dict], message_ids: List[object], parsed: dict):
     """
-    Уведомление всех WebSocket клиентов о новом письме
+    Опубликовать события о новых письмах в шину уведомлений.
+    Тела письма берутся из результата разбора parsed: в БД их может не быть (архив).
+    Письма уже сохранены, поэтому ошибка публикации не влияет на ответ SMTP клиенту.
     """
-    email_id_str = str(email_account_id)
-    if email_id_str in websocket_connections:
-        for websocket in websocket_connections[email_id_str]:
-            try:
-                await websocket.send_json({
-                    "type": "new_message",
-                    "email_account_id": email_id_str,
-                    "message_id": str(message_id)
-                })
-            except Exception as e:
-                logger.error(f"Ошибка отправки WebSocket уведомления: {str(e)}")
+    events = []
+    for row, message_id in zip(rows, message_ids):
+        email_account_id = str(row["email_account_id"])
+        events.append({
+            "type": "new_message",
+            "email_account_id": email_account_id,
+            "message_id": str(message_id),
+            # Само письмо - для клиентов, подписанных в режиме push
+            "message": {
+                "id": str(message_id),
+                "email_account_id": email_account_id,
+                "sender": row["sender"],
+                "recipient": row["recipient"],
+                "subject": row["subject"],
+                "received_at": row["received_at"].isoformat(),
+                "seq": row.get("seq"),
+                "body_text": parsed["body_text"],
+                "body_html": parsed["body_html"],
+                "otp_code": row["otp_code"],
+                "confirm_link": row["confirm_link"],
+            },
+        })
+    try:
+        await asyncio.to_thread(get_notification_bus().publish, events)
+    except Exception as e:
+        logger.error(f"Ошибка отправки уведомлений о новых письмах: {str(e)}")
+
+def handle_bus_event(event: dict):
+    """Сбросить адрес в кэше, если API создал или удалил ящик (возможно, в другом процессе)"""
+    if event.get("type") == "address_invalidated":
+        get_address_index().invalidate(event["email"])
+
+class MeteredSMTP(SMTP):
+    """SMTP сессия с учётом открытых соединений в метриках"""
+    def connection_made(self, transport):
+        SMTP_SESSIONS.inc()
+        SMTP_SESSIONS_ACTIVE.inc()
+        super().connection_made(transport)
+
+    def connection_lost(self, error):
+        SMTP_SESSIONS_ACTIVE.dec()
+        super().connection_lost(error)
+
+class MeteredController(Controller):
+    def factory(self):
+        return MeteredSMTP(self.handler, **self.SMTP_kwargs)
 
 class SMTPServer:
     """
@@ -117,15 +254,27 @@ class SMTPServer:
     
     def start(self):
         """Запуск SMTP сервера"""
+        bus = get_notification_bus()
+        bus.subscribe(handle_bus_event)
+        bus.start()
         handler = EmailHandler()
-        self.controller = Controller(handler, hostname=self.host, port=self.port)
+        # Лимит размера проверяется во время приёма DATA: лишнее не буферизуется, клиент получает 552
+        self.controller = MeteredController(
+            handler, hostname=self.host, port=self.port, data_size_limit=settings.SMTP_MAX_MESSAGE_SIZE
+        )
         self.controller.start()
+        metrics.add_collector("address_index", get_address_index().stats)
+        metrics.add_collector("parser", get_parser_pool().stats)
+        metrics.add_collector("ingest", get_message_writer().stats)
         logger.info(f"SMTP сервер запущен на {self.host}:{self.port}")
     
     def stop(self):
         """Остановка SMTP сервера"""
         if self.controller:
             self.controller.stop()
+            self.controller = None
+            get_notification_bus().unsubscribe(handle_bus_event)
+            get_parser_pool().shutdown()
             logger.info("SMTP сервер остановлен")
 
 # Глобальный экземпляр сервера
@@ -135,6 +284,24 @@ def get_smtp_server() -> SMTPServer:
     """Получить глобальный экземпляр SMTP сервера"""
     global smtp_server
     if smtp_server is None:
-        from ..core.config import settings
         smtp_server = SMTPServer(host=settings.SMTP_HOST, port=settings.SMTP_PORT)
-    return smtp_server
\ No newline at end of file
+    return smtp_server
+
+def main():
+    """Запуск SMTP сервера отдельным процессом"""
+    setup_logging()
+    server = get_smtp_server()
+    server.start()
+    # Отдельному процессу SMTP нужен свой /metrics (у API он общий с HTTP)
+    start_metrics_server(settings.SMTP_METRICS_PORT)
+
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+        get_notification_bus().stop()
+
+if __name__ == "__main__":
+    main()
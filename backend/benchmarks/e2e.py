@@ -0,0 +1,380 @@
+#!/usr/bin/env python3
+# backend/benchmarks/e2e.py
+"""
+Нагрузочный тест полного пути письма: SMTP -> БД -> WebSocket.
+
+Запускает API со встроенным SMTP сервером (uvicorn в отдельном процессе,
+база из DATABASE_URL), создаёт ящики, подписывает на них WebSocket клиентов
+и отправляет письма несколькими SMTP клиентами одновременно. Для каждого
+письма измеряется время SMTP транзакции и время от начала отправки до
+получения письма подписчиком (mode=push). Итог печатается и сохраняется в JSON.
+
+    cd backend
+    python -m benchmarks.e2e --messages 2000 --smtp-clients 8 --ws-subscribers 20 \\
+        --sizes "2k:70,32k:25,1m:5" --output benchmarks/results/e2e.json
+
+    # сравнить с прошлым запуском (например, с другого коммита)
+    python -m benchmarks.e2e --baseline benchmarks/results/e2e-main.json
+
+--url - нагрузить уже запущенный API (SMTP сервер: --smtp-host/--smtp-port).
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import smtplib
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from email.message import EmailMessage
+from typing import Dict, List, Tuple
+
+import websockets
+
+from .common import BACKEND_DIR, change, load_report, report_header, save_report
+
+SIZE_UNITS = {"": 1, "b": 1, "k": 1024, "m": 1024 * 1024}
+# Тема письма: по ней подписчик узнаёт, какое письмо пришло
+SUBJECT_PREFIX = "bench-"
+# Письма больше этого размера отправляются с вложением (разбор base64, хранилище вложений)
+ATTACHMENT_THRESHOLD = 16 * 1024
+
+WORDS = ("код подтверждения регистрация аккаунт письмо проверка сервис "
+         "verification account confirm welcome message service").split()
+
+
+def parse_size(value: str) -> int:
+    match = re.fullmatch(r"\s*(\d+)\s*([bkm]?)\s*", value.lower())
+    if not match:
+        raise argparse.ArgumentTypeError(f"Неверный размер: {value!r}")
+    return int(match.group(1)) * SIZE_UNITS[match.group(2)]
+
+def parse_sizes(value: str) -> List[Tuple[int, float]]:
+    """Распределение размеров писем: "2k:70,32k:25,1m:5" -> [(байт, вес), ...]"""
+    sizes = []
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        size, _, weight = item.partition(":")
+        sizes.append((parse_size(size), float(weight or 1)))
+    if not sizes:
+        raise argparse.ArgumentTypeError("Пустое распределение размеров")
+    return sizes
+
+def percentiles(values: List[float]) -> dict:
+    """p50/p95/p99, среднее и максимум в миллисекундах"""
+    if not values:
+        return {"count": 0}
+    ordered = sorted(values)
+
+    def pick(q: float) -> float:
+        return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+    return {
+        "count": len(ordered),
+        "mean_ms": round(statistics.fmean(ordered) * 1000, 2),
+        "p50_ms": round(pick(0.50) * 1000, 2),
+        "p95_ms": round(pick(0.95) * 1000, 2),
+        "p99_ms": round(pick(0.99) * 1000, 2),
+        "max_ms": round(ordered[-1] * 1000, 2),
+    }
+
+
+def build_message(index: int, sender: str, recipient: str, size: int, rng: random.Random) -> bytes:
+    """Письмо примерно заданного размера: текст, а для больших - ещё и вложение"""
+    msg = EmailMessage()
+    msg["From"] = sender
+    msg["To"] = recipient
+    msg["Subject"] = f"{SUBJECT_PREFIX}{index}"
+    text_size = min(size, ATTACHMENT_THRESHOLD)
+    words = []
+    length = 0
+    while length < text_size:
+        word = rng.choice(WORDS)
+        words.append(word)
+        length += len(word.encode("utf-8")) + 1
+    words.append(f"Ваш код: {rng.randint(100000, 999999)}")
+    msg.set_content(" ".join(words))
+    if size > ATTACHMENT_THRESHOLD:
+        # base64 увеличивает вложение на треть - берём 3/4 от нужного размера
+        payload = rng.randbytes((size - text_size) * 3 // 4)
+        msg.add_attachment(payload, maintype="application", subtype="octet-stream", filename=f"bench-{index}.bin")
+    return msg.as_bytes()
+
+
+class Results:
+    """Времена отправки и получения писем (пишутся из потоков SMTP и цикла событий)"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sent_at: Dict[int, float] = {}
+        self.smtp_latency: List[float] = []
+        self.e2e_latency: List[float] = []
+        self.notified = set()
+        self.failed: Dict[str, int] = defaultdict(int)
+        self.early: Dict[int, float] = {}
+
+    def started(self, index: int, at: float):
+        with self.lock:
+            self.sent_at[index] = at
+            # Уведомление могло прийти раньше, чем поток отметил начало (гонка потоков)
+            if index in self.early:
+                self._received(index, self.early.pop(index))
+
+    def accepted(self, index: int, elapsed: float):
+        with self.lock:
+            self.smtp_latency.append(elapsed)
+
+    def failure(self, reason: str):
+        with self.lock:
+            self.failed[reason] += 1
+
+    def received(self, index: int, at: float):
+        with self.lock:
+            if index in self.sent_at:
+                self._received(index, at)
+            else:
+                self.early[index] = at
+
+    def _received(self, index: int, at: float):
+        if index not in self.notified:
+            self.notified.add(index)
+            self.e2e_latency.append(at - self.sent_at[index])
+
+
+def http_json(method: str, url: str, timeout: float = 30):
+    request = urllib.request.Request(url, method=method, data=b"" if method == "POST" else None)
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.loads(response.read())
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def start_server(args) -> Tuple[subprocess.Popen, str, int]:
+    """API со встроенным SMTP сервером в отдельном процессе"""
+    http_port = free_port()
+    smtp_port = free_port()
+    env = dict(
+        os.environ,
+        SMTP_EMBEDDED="true",
+        SMTP_HOST="127.0.0.1",
+        SMTP_PORT=str(smtp_port),
+        # Ящики живут дольше прогона, сборщик не должен мешать измерениям
+        REAPER_ENABLED="false",
+        LOG_LEVEL=os.environ.get("LOG_LEVEL", "WARNING"),
+    )
+    command = [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1",
+               "--port", str(http_port), "--log-level", "warning", "--no-access-log"]
+    server = subprocess.Popen(command, cwd=BACKEND_DIR, env=env)
+    url = f"http://127.0.0.1:{http_port}"
+    deadline = time.monotonic() + args.startup_timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"API завершился при запуске (код {server.returncode})")
+        try:
+            http_json("GET", f"{url}/health", timeout=1)
+            return server, url, smtp_port
+        except OSError:
+            time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError("API не запустился вовремя")
+
+
+async def subscribe(ws_url: str, results: Results, ready: asyncio.Event, stop: asyncio.Event):
+    """Подписчик одного ящика в режиме push: отмечает время прихода каждого письма"""
+    async with websockets.connect(f"{ws_url}?mode=push&projection=headers", max_size=None) as ws:
+        greeting = json.loads(await ws.recv())
+        if greeting.get("type") != "connected":
+            raise RuntimeError(f"Неожиданный ответ WebSocket: {greeting}")
+        ready.set()
+        while not stop.is_set():
+            try:
+                raw = await asyncio.wait_for(ws.recv(), timeout=0.5)
+            except asyncio.TimeoutError:
+                continue
+            at = time.perf_counter()
+            event = json.loads(raw)
+            subject = (event.get("message") or {}).get("subject") or ""
+            if event.get("type") == "message" and subject.startswith(SUBJECT_PREFIX):
+                results.received(int(subject[len(SUBJECT_PREFIX):]), at)
+
+def smtp_client(host: str, port: int, jobs: List[Tuple[int, str, bytes]], results: Results):
+    """Один SMTP клиент: отправляет свою часть писем по одному соединению"""
+    smtp = None
+    for index, recipient, data in jobs:
+        try:
+            if smtp is None:
+                smtp = smtplib.SMTP(host, port, timeout=60)
+            started = time.perf_counter()
+            results.started(index, started)
+            smtp.sendmail("bench@sender.test", [recipient], data)
+            results.accepted(index, time.perf_counter() - started)
+        except smtplib.SMTPResponseException as e:
+            results.failure(f"smtp_{e.smtp_code}")
+        except (OSError, smtplib.SMTPException) as e:
+            results.failure(type(e).__name__)
+            smtp = None
+    if smtp is not None:
+        try:
+            smtp.quit()
+        except (OSError, smtplib.SMTPException):
+            pass
+
+
+async def run(args) -> dict:
+    server = None
+    if args.url:
+        url, smtp_host, smtp_port = args.url.rstrip("/"), args.smtp_host, args.smtp_port
+    else:
+        server, url, smtp_port = await asyncio.to_thread(start_server, args)
+        smtp_host = "127.0.0.1"
+    try:
+        return await run_load(args, url, smtp_host, smtp_port)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=30)
+
+async def run_load(args, url: str, smtp_host: str, smtp_port: int) -> dict:
+    api = f"{url}/api/v1"
+    rng = random.Random(args.seed)
+    mailboxes = [await asyncio.to_thread(http_json, "POST", f"{api}/email") for _ in range(args.mailboxes)]
+
+    # Заранее собираем письма, чтобы генерация не попадала в измерения
+    sizes, weights = zip(*args.sizes)
+    jobs = []
+    payload_bytes = 0
+    for index in range(args.messages):
+        mailbox = mailboxes[index % len(mailboxes)]
+        data = build_message(index, "bench@sender.test", mailbox["email"], rng.choices(sizes, weights)[0], rng)
+        payload_bytes += len(data)
+        jobs.append((index, mailbox["email"], data))
+
+    results = Results()
+    stop = asyncio.Event()
+    ws_base = url.replace("http", "ws", 1)
+    subscribers = []
+    for number in range(args.ws_subscribers):
+        ready = asyncio.Event()
+        mailbox = mailboxes[number % len(mailboxes)]
+        subscribers.append(asyncio.create_task(
+            subscribe(f"{ws_base}/api/v1/ws/{mailbox['id']}", results, ready, stop)
+        ))
+        await asyncio.wait_for(ready.wait(), timeout=30)
+    watched = {mailboxes[number % len(mailboxes)]["email"] for number in range(args.ws_subscribers)}
+    expected = sum(1 for _, recipient, _ in jobs if recipient in watched)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.smtp_clients) as executor:
+        futures = [
+            asyncio.wrap_future(executor.submit(smtp_client, smtp_host, smtp_port, jobs[number::args.smtp_clients], results))
+            for number in range(args.smtp_clients)
+        ]
+        await asyncio.gather(*futures)
+    sent_seconds = time.perf_counter() - started
+
+    # Дожидаемся последних уведомлений
+    deadline = time.monotonic() + args.drain_timeout
+    while len(results.notified) < expected and time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+    total_seconds = time.perf_counter() - started
+    stop.set()
+    await asyncio.gather(*subscribers, return_exceptions=True)
+
+    accepted = len(results.smtp_latency)
+    return {
+        **report_header("e2e"),
+        "config": {
+            "messages": args.messages,
+            "smtp_clients": args.smtp_clients,
+            "ws_subscribers": args.ws_subscribers,
+            "mailboxes": args.mailboxes,
+            "sizes": [{"bytes": size, "weight": weight} for size, weight in args.sizes],
+            "seed": args.seed,
+            "external_server": bool(args.url),
+        },
+        "results": {
+            "accepted": accepted,
+            "failed": dict(results.failed),
+            "payload_mb": round(payload_bytes / 1024 / 1024, 2),
+            "send_seconds": round(sent_seconds, 3),
+            "throughput_msgs_per_second": round(accepted / sent_seconds, 1) if sent_seconds else 0.0,
+            "throughput_mb_per_second": round(payload_bytes / 1024 / 1024 / sent_seconds, 2) if sent_seconds else 0.0,
+            "notifications_expected": expected,
+            "notifications_received": len(results.notified),
+            "notifications_lost": expected - len(results.notified),
+            "total_seconds": round(total_seconds, 3),
+            "smtp_latency": percentiles(results.smtp_latency),
+            "e2e_latency": percentiles(results.e2e_latency),
+        },
+    }
+
+
+def compare(report: dict, baseline: dict) -> List[str]:
+    """Изменение ключевых показателей относительно прошлого прогона"""
+    lines = [f"Сравнение с {baseline.get('commit')} ({baseline.get('created_at')}):"]
+    pairs = [("throughput_msgs_per_second", None)] + [
+        (group, key) for group in ("smtp_latency", "e2e_latency") for key in ("p50_ms", "p95_ms", "p99_ms")
+    ]
+    for group, key in pairs:
+        old = baseline["results"].get(group)
+        new = report["results"].get(group)
+        if key is not None:
+            old, new = (old or {}).get(key), (new or {}).get(key)
+        name = group if key is None else f"{group}.{key}"
+        if old is None:
+            continue
+        lines.append(f"  {name}: {change(old, new)}")
+    return lines
+
+def print_report(report: dict):
+    results = report["results"]
+    print(f"Принято писем: {results['accepted']} за {results['send_seconds']} с "
+          f"({results['throughput_msgs_per_second']} писем/с, {results['throughput_mb_per_second']} МБ/с)")
+    if results["failed"]:
+        print(f"Ошибки SMTP: {results['failed']}")
+    print(f"Уведомления: {results['notifications_received']} из {results['notifications_expected']}"
+          f" (потеряно {results['notifications_lost']})")
+    for name in ("smtp_latency", "e2e_latency"):
+        stats = results[name]
+        if stats["count"]:
+            print(f"{name}: p50 {stats['p50_ms']} мс, p95 {stats['p95_ms']} мс, "
+                  f"p99 {stats['p99_ms']} мс, max {stats['max_ms']} мс")
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест SMTP -> БД -> WebSocket")
+    parser.add_argument("--messages", type=int, default=1000, help="сколько писем отправить")
+    parser.add_argument("--smtp-clients", type=int, default=8, help="одновременных SMTP клиентов")
+    parser.add_argument("--ws-subscribers", type=int, default=10, help="WebSocket подписчиков")
+    parser.add_argument("--mailboxes", type=int, default=None, help="ящиков-получателей (по умолчанию - по числу подписчиков)")
+    parser.add_argument("--sizes", type=parse_sizes, default=parse_sizes("2k:80,32k:15,512k:5"),
+                        help='распределение размеров писем, "размер:вес,..."')
+    parser.add_argument("--seed", type=int, default=1, help="seed генератора писем")
+    parser.add_argument("--drain-timeout", type=float, default=30, help="сколько ждать последних уведомлений (с)")
+    parser.add_argument("--startup-timeout", type=float, default=60, help="сколько ждать запуска API (с)")
+    parser.add_argument("--url", help="адрес уже запущенного API вместо запуска своего")
+    parser.add_argument("--smtp-host", default="127.0.0.1", help="SMTP сервер для --url")
+    parser.add_argument("--smtp-port", type=int, default=1025, help="SMTP порт для --url")
+    parser.add_argument("--output", help="файл JSON с результатами")
+    parser.add_argument("--baseline", help="JSON прошлого прогона для сравнения")
+    args = parser.parse_args()
+    args.mailboxes = args.mailboxes or max(args.ws_subscribers, 1)
+    if args.ws_subscribers > args.mailboxes:
+        parser.error("--ws-subscribers не может превышать --mailboxes")
+
+    report = asyncio.run(run(args))
+    print_report(report)
+    if args.baseline:
+        print("\n".join(compare(report, load_report(args.baseline))))
+    if args.output:
+        save_report(report, args.output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+# backend/benchmarks/micro.py
+"""
+Микробенчмарки горячих функций: разбор писем, генерация адресов,
+сериализация писем для ответа API.
+
+Для каждой функции: время одного вызова (лучший, медиана и разброс
+по нескольким раундам), вызовов в секунду и пик выделенной памяти
+на один вызов (tracemalloc). БД и сеть не нужны.
+
+    cd backend
+    python -m benchmarks.micro --output benchmarks/results/micro.json
+    python -m benchmarks.micro -k parse --baseline benchmarks/results/micro-main.json
+"""
+import argparse
+import json
+import statistics
+import time
+import tracemalloc
+import uuid
+from datetime import datetime, timedelta, timezone
+from email.header import Header
+from email.message import EmailMessage
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from types import SimpleNamespace
+from typing import Callable, List, Tuple
+
+from pydantic import TypeAdapter
+
+from app import schemas
+from app.services.email_parser import discard_attachments, parse_email_message
+from app.services.email_service import generate_temp_email, generate_temp_emails
+from app.services.parser_pool import parse_incoming
+
+from .common import change, load_report, report_header, save_report
+
+# Текст уведомления: код, ссылка, немного вёрстки
+PLAIN_TEXT = (
+    "Здравствуйте!\n\nВаш код подтверждения: 482913. Он действует 10 минут.\n"
+    "Чтобы завершить регистрацию, перейдите по ссылке: https://example.com/confirm?token=9f8e7d6c5b4a\n\n"
+    "Если вы не запрашивали код, просто проигнорируйте это письмо.\n"
+) * 3
+HTML_TEXT = (
+    "<html><head><style>p{margin:0}</style></head><body>"
+    + "<table><tr><td><p>Здравствуйте!</p><p>Ваш код подтверждения: <b>482913</b></p>"
+    + '<p><a href="https://example.com/confirm?token=9f8e7d6c5b4a">Подтвердить email</a></p>'
+    + '<p><a href="https://example.com/unsubscribe">Отписаться</a></p></td></tr></table>' * 20
+    + "</body></html>"
+)
+
+
+def plain_message() -> bytes:
+    msg = EmailMessage()
+    msg["From"] = "Сервис <noreply@example.com>"
+    msg["To"] = "user@temp.atv.local"
+    msg["Subject"] = "Код подтверждения"
+    msg["Date"] = "Mon, 18 Oct 2026 10:00:00 +0300"
+    msg.set_content(PLAIN_TEXT)
+    return msg.as_bytes()
+
+def alternative_message() -> bytes:
+    msg = EmailMessage()
+    msg["From"] = "noreply@example.com"
+    msg["To"] = "user@temp.atv.local"
+    msg["Subject"] = "Подтвердите регистрацию"
+    msg.set_content(PLAIN_TEXT)
+    msg.add_alternative(HTML_TEXT, subtype="html")
+    return msg.as_bytes()
+
+def nested_attachments_message() -> bytes:
+    """mixed(related(alternative(text, html), картинка), pdf, csv) - как у писем с счётом"""
+    msg = EmailMessage()
+    msg["From"] = "billing@example.com"
+    msg["To"] = "user@temp.atv.local"
+    msg["Subject"] = "Счёт за октябрь"
+    msg.set_content(PLAIN_TEXT)
+    msg.add_alternative(HTML_TEXT, subtype="html")
+    msg.get_payload()[1].add_related(bytes(range(256)) * 64, maintype="image", subtype="png", cid="<logo>")
+    msg.add_attachment(bytes(range(256)) * 1024, maintype="application", subtype="pdf", filename="счёт.pdf")
+    msg.add_attachment("дата;сумма\n" * 500, subtype="csv", filename="detail.csv")
+    return msg.as_bytes()
+
+def legacy_charset_message() -> bytes:
+    """Письмо старого почтового клиента: KOI8-R и windows-1251, заголовки в RFC 2047"""
+    msg = MIMEMultipart("alternative")
+    msg["From"] = Header("Сервис", "koi8-r").encode() + " <noreply@example.ru>"
+    msg["To"] = "user@temp.atv.local"
+    msg["Subject"] = Header("Код подтверждения для входа", "windows-1251")
+    msg.attach(MIMEText(PLAIN_TEXT, "plain", "koi8-r"))
+    msg.attach(MIMEText(HTML_TEXT, "html", "windows-1251"))
+    return msg.as_bytes()
+
+CORPUS = {
+    "plain": plain_message,
+    "alternative": alternative_message,
+    "nested_attachments": nested_attachments_message,
+    "legacy_charset": legacy_charset_message,
+}
+
+
+def email_messages(count: int) -> List[SimpleNamespace]:
+    """Письма в виде объектов с атрибутами, как строки ORM для from_attributes"""
+    received_at = datetime(2026, 10, 18, tzinfo=timezone.utc)
+    account_id = uuid.uuid4()
+    return [
+        SimpleNamespace(
+            id=uuid.uuid4(), email_account_id=account_id, sender="noreply@example.com",
+            recipient="user@temp.atv.local", subject=f"Код подтверждения {i}", body_text=PLAIN_TEXT,
+            body_html=HTML_TEXT, received_at=received_at + timedelta(seconds=i), seq=i,
+            otp_code="482913", confirm_link="https://example.com/confirm?token=9f8e7d6c5b4a",
+        )
+        for i in range(count)
+    ]
+
+MESSAGE_LIST = TypeAdapter(List[schemas.EmailMessage])
+
+def serialize_response(messages) -> bytes:
+    """Путь response_model=List[EmailMessage]: проверка моделей, затем dict и json.dumps"""
+    models = [schemas.EmailMessage.model_validate(message) for message in messages]
+    return json.dumps([model.model_dump(mode="json") for model in models], ensure_ascii=False).encode("utf-8")
+
+def serialize_adapter(messages) -> bytes:
+    """Проверка и сериализация списка одним TypeAdapter (pydantic-core целиком)"""
+    return MESSAGE_LIST.dump_json(MESSAGE_LIST.validate_python(messages, from_attributes=True))
+
+
+def parse_and_discard(raw: bytes):
+    discard_attachments(parse_email_message(raw)["attachments"])
+
+def parse_incoming_and_discard(raw: bytes):
+    discard_attachments(parse_incoming(raw)["attachments"])
+
+def benchmarks() -> List[Tuple[str, Callable[[], object], dict]]:
+    """(имя, функция без аргументов, параметры для отчёта)"""
+    cases = []
+    for name, build in CORPUS.items():
+        raw = build()
+        info = {"message_bytes": len(raw)}
+        cases.append((f"parse_email_message[{name}]", lambda raw=raw: parse_and_discard(raw), info))
+        cases.append((f"parse_incoming[{name}]", lambda raw=raw: parse_incoming_and_discard(raw), info))
+    cases.append(("generate_temp_email", generate_temp_email, {}))
+    cases.append(("generate_temp_emails[100]", lambda: generate_temp_emails(100), {"batch": 100}))
+    for count in (1, 10, 100, 1000):
+        messages = email_messages(count)
+        info = {"messages": count}
+        cases.append((f"serialize_response[{count}]", lambda messages=messages: serialize_response(messages), info))
+        cases.append((f"serialize_adapter[{count}]", lambda messages=messages: serialize_adapter(messages), info))
+    return cases
+
+
+def calibrate(fn: Callable[[], object], min_time: float) -> int:
+    """Число вызовов в раунде, чтобы раунд длился не меньше min_time"""
+    number = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(number):
+            fn()
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_time:
+            return number
+        number = max(number * 2, int(number * min_time / max(elapsed, 1e-9) * 1.2))
+
+def measure_memory(fn: Callable[[], object]) -> dict:
+    """Пик памяти одного вызова сверх уже выделенной (tracemalloc замедляет код - время меряется отдельно)"""
+    tracemalloc.start()
+    try:
+        fn()  # прогрев: кэши модулей не должны попадать в пик
+        tracemalloc.reset_peak()
+        before, _ = tracemalloc.get_traced_memory()
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"peak_kb": round((peak - before) / 1024, 1)}
+
+def run_benchmark(fn: Callable[[], object], rounds: int, min_time: float) -> dict:
+    fn()
+    number = calibrate(fn, min_time)
+    timings = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        for _ in range(number):
+            fn()
+        timings.append((time.perf_counter() - started) / number)
+    median = statistics.median(timings)
+    return {
+        "calls_per_round": number,
+        "rounds": rounds,
+        "min_us": round(min(timings) * 1e6, 2),
+        "median_us": round(median * 1e6, 2),
+        "stdev_us": round(statistics.stdev(timings) * 1e6, 2) if len(timings) > 1 else 0.0,
+        "ops_per_second": round(1 / median, 1),
+        **measure_memory(fn),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Микробенчмарки разбора писем, генерации адресов и сериализации")
+    parser.add_argument("-k", dest="keyword", help="запускать только бенчмарки, в имени которых есть эта строка")
+    parser.add_argument("--rounds", type=int, default=5, help="раундов на бенчмарк")
+    parser.add_argument("--min-time", type=float, default=0.2, help="минимальная длительность раунда (с)")
+    parser.add_argument("--output", help="файл JSON с результатами")
+    parser.add_argument("--baseline", help="JSON прошлого прогона для сравнения")
+    args = parser.parse_args()
+
+    baseline = load_report(args.baseline)["results"] if args.baseline else {}
+    results = {}
+    print(f"{'бенчмарк':<40} {'медиана, мкс':>14} {'вызовов/с':>12} {'пик, КБ':>10}")
+    for name, fn, info in benchmarks():
+        if args.keyword and args.keyword not in name:
+            continue
+        result = {**info, **run_benchmark(fn, args.rounds, args.min_time)}
+        results[name] = result
+        line = f"{name:<40} {result['median_us']:>14} {result['ops_per_second']:>12} {result['peak_kb']:>10}"
+        if name in baseline:
+            line += f"   было: {change(baseline[name]['median_us'], result['median_us'])} мкс," \
+                    f" {change(baseline[name]['peak_kb'], result['peak_kb'])} КБ"
+        print(line)
+
+    if args.output:
+        save_report({
+            **report_header("micro"),
+            "config": {"rounds": args.rounds, "min_time": args.min_time, "keyword": args.keyword},
+            "results": results,
+        }, args.output)
+
+if __name__ == "__main__":
+    main()
@@ -15,12 +15,15 @@ def init_database():
             # Выполняем команды по одной
             commands = [
                 text('CREATE EXTENSION IF NOT EXISTS "uuid-ossp"'),
+                text('CREATE EXTENSION IF NOT EXISTS pg_trgm'),
                 text('''
                 CREATE TABLE IF NOT EXISTS email_accounts (
                     id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
                     email VARCHAR(255) UNIQUE NOT NULL,
                     created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
-                    is_active BOOLEAN DEFAULT TRUE
+                    expires_at TIMESTAMP WITH TIME ZONE,
+                    is_active BOOLEAN DEFAULT TRUE,
+                    message_version BIGINT NOT NULL DEFAULT 0
                 )
                 '''),
                 text('''
@@ -32,11 +35,53 @@ def init_database():
                     subject TEXT,
                     body_text TEXT,
                     body_html TEXT,
-                    received_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+                    received_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+                    seq BIGINT
                 )
                 '''),
+                text('''
+                CREATE TABLE IF NOT EXISTS email_attachments (
+                    id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+                    message_id UUID NOT NULL,
+                    email_account_id UUID NOT NULL,
+                    filename TEXT,
+                    content_type VARCHAR(255) NOT NULL,
+                    size BIGINT NOT NULL,
+                    sha256 VARCHAR(64) NOT NULL,
+                    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+                )
+                '''),
+                # Для баз, созданных до появления инкрементальной синхронизации
+                text('ALTER TABLE email_accounts ADD COLUMN IF NOT EXISTS message_version BIGINT NOT NULL DEFAULT 0'),
+                text('ALTER TABLE email_messages ADD COLUMN IF NOT EXISTS seq BIGINT'),
+                text('ALTER TABLE email_accounts ADD COLUMN IF NOT EXISTS pooled BOOLEAN NOT NULL DEFAULT FALSE'),
+                # Сжатое исходное письмо: уже сжато, поэтому без повторного сжатия в TOAST
+                text('ALTER TABLE email_messages ADD COLUMN IF NOT EXISTS raw_message BYTEA'),
+                text('ALTER TABLE email_messages ADD COLUMN IF NOT EXISTS raw_encoding VARCHAR(16)'),
+                text('ALTER TABLE email_messages ALTER COLUMN raw_message SET STORAGE EXTERNAL'),
+                # Код и ссылка подтверждения, извлечённые при приёме письма
+                text('ALTER TABLE email_messages ADD COLUMN IF NOT EXISTS otp_code VARCHAR(16)'),
+                text('ALTER TABLE email_messages ADD COLUMN IF NOT EXISTS confirm_link TEXT'),
+                text('ALTER TABLE email_messages ADD COLUMN IF NOT EXISTS search_vector TSVECTOR'),
                 text('CREATE INDEX IF NOT EXISTS idx_email_accounts_email ON email_accounts(email)'),
                 text('CREATE INDEX IF NOT EXISTS idx_email_messages_account ON email_messages(email_account_id)'),
+                text('CREATE INDEX IF NOT EXISTS idx_email_accounts_expires_at ON email_accounts(expires_at)'),
+                text('CREATE INDEX IF NOT EXISTS idx_email_accounts_pooled ON email_accounts(id) WHERE pooled'),
+                # Постраничный вывод писем ящика по курсору (received_at, id)
+                text('CREATE INDEX IF NOT EXISTS idx_email_messages_account_received ON email_messages(email_account_id, received_at, id)'),
+                # Инкрементальная синхронизация по seq
+                text('CREATE INDEX IF NOT EXISTS idx_email_messages_account_seq ON email_messages(email_account_id, seq)'),
+                # Последний код / ссылка ящика
+                text('CREATE INDEX IF NOT EXISTS idx_email_messages_account_code ON email_messages(email_account_id, seq) INCLUDE (otp_code, id, received_at) WHERE otp_code IS NOT NULL'),
+                text('CREATE INDEX IF NOT EXISTS idx_email_messages_account_link ON email_messages(email_account_id, seq) WHERE confirm_link IS NOT NULL'),
+                # Поиск писем: полнотекстовый и по подстроке в отправителе и теме
+                text('CREATE INDEX IF NOT EXISTS idx_email_messages_search ON email_messages USING gin (search_vector)'),
+                text('CREATE INDEX IF NOT EXISTS idx_email_messages_sender_trgm ON email_messages USING gin (sender gin_trgm_ops)'),
+                text('CREATE INDEX IF NOT EXISTS idx_email_messages_subject_trgm ON email_messages USING gin (subject gin_trgm_ops)'),
+                # Вложения: по письму, по ящику (удаление) и по содержимому (сборка мусора)
+                text('CREATE INDEX IF NOT EXISTS idx_email_attachments_message ON email_attachments(message_id)'),
+                text('CREATE INDEX IF NOT EXISTS idx_email_attachments_account ON email_attachments(email_account_id)'),
+                text('CREATE INDEX IF NOT EXISTS idx_email_attachments_sha256 ON email_attachments(sha256)'),
             ]
             
             for i, cmd in enumerate(commands, 1):
@@ -1 +1,79 @@
-CREATE EXTENSION IF NOT EXISTS "uuid-ossp";
\ No newline at end of file
+CREATE EXTENSION IF NOT EXISTS "uuid-ossp";
+-- Триграммные индексы для поиска подстроки в отправителе и теме
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE TABLE IF NOT EXISTS email_accounts (
+    id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+    email VARCHAR(255) UNIQUE NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    expires_at TIMESTAMP WITH TIME ZONE,
+    is_active BOOLEAN DEFAULT TRUE,
+    message_version BIGINT NOT NULL DEFAULT 0,
+    pooled BOOLEAN NOT NULL DEFAULT FALSE
+);
+
+CREATE TABLE IF NOT EXISTS email_messages (
+    id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+    email_account_id UUID REFERENCES email_accounts(id),
+    sender VARCHAR(255) NOT NULL,
+    recipient VARCHAR(255) NOT NULL,
+    subject TEXT,
+    body_text TEXT,
+    body_html TEXT,
+    received_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    seq BIGINT
+);
+
+-- Для баз, созданных до появления инкрементальной синхронизации
+ALTER TABLE email_accounts ADD COLUMN IF NOT EXISTS message_version BIGINT NOT NULL DEFAULT 0;
+ALTER TABLE email_messages ADD COLUMN IF NOT EXISTS seq BIGINT;
+-- Для баз, созданных до появления пула ящиков
+ALTER TABLE email_accounts ADD COLUMN IF NOT EXISTS pooled BOOLEAN NOT NULL DEFAULT FALSE;
+-- Сжатое исходное письмо (RAW_MESSAGE_STORAGE); уже сжато - без повторного сжатия в TOAST
+ALTER TABLE email_messages ADD COLUMN IF NOT EXISTS raw_message BYTEA;
+ALTER TABLE email_messages ADD COLUMN IF NOT EXISTS raw_encoding VARCHAR(16);
+ALTER TABLE email_messages ALTER COLUMN raw_message SET STORAGE EXTERNAL;
+-- Код и ссылка подтверждения, извлечённые при приёме письма
+ALTER TABLE email_messages ADD COLUMN IF NOT EXISTS otp_code VARCHAR(16);
+ALTER TABLE email_messages ADD COLUMN IF NOT EXISTS confirm_link TEXT;
+-- Полнотекстовый поиск, заполняется при приёме письма
+ALTER TABLE email_messages ADD COLUMN IF NOT EXISTS search_vector TSVECTOR;
+
+CREATE INDEX IF NOT EXISTS idx_email_accounts_email ON email_accounts(email);
+CREATE INDEX IF NOT EXISTS idx_email_messages_account ON email_messages(email_account_id);
+
+-- Поиск просроченных ящиков сборщиком
+CREATE INDEX IF NOT EXISTS idx_email_accounts_expires_at ON email_accounts(expires_at);
+
+-- Выдача ящиков из пула заранее созданных
+CREATE INDEX IF NOT EXISTS idx_email_accounts_pooled ON email_accounts(id) WHERE pooled;
+
+-- Постраничный вывод писем ящика по курсору (received_at, id)
+CREATE INDEX IF NOT EXISTS idx_email_messages_account_received ON email_messages(email_account_id, received_at, id);
+
+-- Инкрементальная синхронизация по seq
+CREATE INDEX IF NOT EXISTS idx_email_messages_account_seq ON email_messages(email_account_id, seq);
+-- Последний код / ссылка ящика (GET /email/{id}/latest-code, /latest-link)
+CREATE INDEX IF NOT EXISTS idx_email_messages_account_code ON email_messages(email_account_id, seq) INCLUDE (otp_code, id, received_at) WHERE otp_code IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_email_messages_account_link ON email_messages(email_account_id, seq) WHERE confirm_link IS NOT NULL;
+-- Поиск писем (GET /email/{id}/messages/search, /messages/search)
+CREATE INDEX IF NOT EXISTS idx_email_messages_search ON email_messages USING gin (search_vector);
+CREATE INDEX IF NOT EXISTS idx_email_messages_sender_trgm ON email_messages USING gin (sender gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_email_messages_subject_trgm ON email_messages USING gin (subject gin_trgm_ops);
+
+-- Вложения: содержимое лежит в хранилище вложений под ключом sha256
+-- (без внешних ключей, см. partitioned.sql)
+CREATE TABLE IF NOT EXISTS email_attachments (
+    id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+    message_id UUID NOT NULL,
+    email_account_id UUID NOT NULL,
+    filename TEXT,
+    content_type VARCHAR(255) NOT NULL,
+    size BIGINT NOT NULL,
+    sha256 VARCHAR(64) NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_email_attachments_message ON email_attachments(message_id);
+CREATE INDEX IF NOT EXISTS idx_email_attachments_account ON email_attachments(email_account_id);
+CREATE INDEX IF NOT EXISTS idx_email_attachments_sha256 ON email_attachments(sha256);
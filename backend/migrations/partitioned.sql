@@ -0,0 +1,87 @@
+-- Секционирование email_messages по received_at (суточные секции).
+--
+-- Выполняется после init.sql; повторный запуск ничего не меняет. Существующие
+-- письма переносятся в новую таблицу. После миграции включите
+-- MESSAGE_PARTITIONING=true: сборщик просроченных ящиков будет создавать
+-- секции заранее и удалять устаревшие целиком вместо построчного DELETE.
+--
+-- Отличия от обычной схемы:
+--   * первичный ключ (id, received_at) - ключ секции обязан входить в него;
+--   * нет внешнего ключа на email_accounts - ящик удаляется сразу, а его
+--     письма остаются до удаления своей секции и через API уже недоступны.
+
+DO $$
+DECLARE
+    day date;
+BEGIN
+    IF (SELECT relkind FROM pg_class WHERE oid = to_regclass('email_messages')) = 'p' THEN
+        RAISE NOTICE 'email_messages уже разбита на секции';
+        RETURN;
+    END IF;
+
+    ALTER TABLE email_messages RENAME TO email_messages_unpartitioned;
+
+    CREATE TABLE email_messages (
+        id UUID NOT NULL DEFAULT gen_random_uuid(),
+        email_account_id UUID,
+        sender VARCHAR(255) NOT NULL,
+        recipient VARCHAR(255) NOT NULL,
+        subject TEXT,
+        body_text TEXT,
+        body_html TEXT,
+        received_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        seq BIGINT,
+        raw_message BYTEA,
+        raw_encoding VARCHAR(16),
+        otp_code VARCHAR(16),
+        confirm_link TEXT,
+        search_vector TSVECTOR
+    ) PARTITION BY RANGE (received_at);
+
+    ALTER TABLE email_messages ALTER COLUMN raw_message SET STORAGE EXTERNAL;
+
+    -- Письма вне созданных секций; менеджер секций переносит их при создании секции
+    CREATE TABLE email_messages_default PARTITION OF email_messages DEFAULT;
+
+    -- Секции за последнюю неделю и на три дня вперёд, более старые письма - в секцию по умолчанию
+    FOR day IN
+        SELECT generate_series(
+            GREATEST(
+                (SELECT min(received_at) FROM email_messages_unpartitioned),
+                now() - interval '7 days'
+            ) AT TIME ZONE 'UTC',
+            now() AT TIME ZONE 'UTC' + interval '3 days',
+            interval '1 day'
+        )::date
+    LOOP
+        EXECUTE format(
+            'CREATE TABLE %I PARTITION OF email_messages FOR VALUES FROM (%L) TO (%L)',
+            'email_messages_p' || to_char(day, 'YYYYMMDD'),
+            day::timestamp AT TIME ZONE 'UTC',
+            (day + 1)::timestamp AT TIME ZONE 'UTC'
+        );
+    END LOOP;
+
+    INSERT INTO email_messages (id, email_account_id, sender, recipient, subject, body_text, body_html,
+                                received_at, seq, raw_message, raw_encoding, otp_code, confirm_link,
+                                search_vector)
+    SELECT id, email_account_id, sender, recipient, subject, body_text, body_html,
+           COALESCE(received_at, now()), seq, raw_message, raw_encoding, otp_code, confirm_link,
+           search_vector
+    FROM email_messages_unpartitioned;
+
+    DROP TABLE email_messages_unpartitioned;
+
+    -- Индексы создаются на каждой секции автоматически; имена освободились после DROP
+    ALTER TABLE email_messages ADD CONSTRAINT email_messages_pkey PRIMARY KEY (id, received_at);
+    CREATE INDEX idx_email_messages_account ON email_messages(email_account_id);
+    CREATE INDEX idx_email_messages_account_received ON email_messages(email_account_id, received_at, id);
+    CREATE INDEX idx_email_messages_account_seq ON email_messages(email_account_id, seq);
+    CREATE INDEX idx_email_messages_account_code ON email_messages(email_account_id, seq)
+        INCLUDE (otp_code, id, received_at) WHERE otp_code IS NOT NULL;
+    CREATE INDEX idx_email_messages_account_link ON email_messages(email_account_id, seq)
+        WHERE confirm_link IS NOT NULL;
+    CREATE INDEX idx_email_messages_search ON email_messages USING gin (search_vector);
+    CREATE INDEX idx_email_messages_sender_trgm ON email_messages USING gin (sender gin_trgm_ops);
+    CREATE INDEX idx_email_messages_subject_trgm ON email_messages USING gin (subject gin_trgm_ops);
+END $$;
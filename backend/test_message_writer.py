@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# backend/test_message_writer.py
+"""
+Проверка пакетной записи писем: письмо, которое БД отклоняет, не должно
+ломать запись остальных писем пакета, в том числе писем с вложениями.
+Нужна БД из DATABASE_URL (таблицы создаются при запуске API или init_db.py).
+
+Использование: python test_message_writer.py  (или pytest test_message_writer.py)
+"""
+import asyncio
+import hashlib
+import os
+import sys
+import tempfile
+import uuid
+from datetime import datetime, timezone
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import delete, select
+
+from app.database import SessionLocal
+from app.models import EmailAccount, EmailAttachment, EmailMessage
+from app.services.blob_store import get_blob_store, release_blobs
+from app.services.email_parser import discard_attachments
+from app.services.message_writer import MessageWriter
+
+
+def spool(content: bytes) -> dict:
+    """Временный файл вложения - как после parse_email_message"""
+    fd, path = tempfile.mkstemp(prefix="atv-attachment-test-")
+    with os.fdopen(fd, "wb") as f:
+        f.write(content)
+    return {
+        "filename": "invoice.pdf",
+        "content_type": "application/pdf",
+        "size": len(content),
+        "sha256": hashlib.sha256(content).hexdigest(),
+        "path": path,
+    }
+
+def message_row(account: EmailAccount, sender: str, attachments: list) -> dict:
+    return {
+        "email_account_id": account.id,
+        "sender": sender,
+        "recipient": account.email,
+        "subject": "Тест пакетной записи",
+        "body_text": "Текст",
+        "body_html": None,
+        "received_at": datetime.now(timezone.utc),
+        "otp_code": None,
+        "confirm_link": None,
+        "search_document": "Тест пакетной записи",
+        "raw_message": None,
+        "raw_encoding": None,
+        "attachments": attachments,
+    }
+
+async def submit_together(writer: MessageWriter, jobs: list) -> list:
+    # Оба задания попадают в один пакет: он собирается batch_interval_ms
+    return await asyncio.gather(*(writer.submit(rows) for rows in jobs), return_exceptions=True)
+
+
+def test_bad_message_does_not_break_batch_with_attachments():
+    db = SessionLocal()
+    account = EmailAccount(id=uuid.uuid4(), email=f"writer-{uuid.uuid4().hex[:10]}@temp.atv.local")
+    db.add(account)
+    db.commit()
+    attachment = spool(os.urandom(4096) + uuid.uuid4().bytes)
+    try:
+        good = [message_row(account, "good@example.com", [attachment])]
+        # Длиннее колонки sender (255) - INSERT этой строки отклоняется БД
+        bad = [message_row(account, "x" * 300 + "@example.com", [])]
+
+        writer = MessageWriter(batch_size=100, batch_interval_ms=200)
+        good_result, bad_result = asyncio.run(submit_together(writer, [good, bad]))
+
+        assert not isinstance(good_result, Exception), f"Хорошее письмо отклонено: {good_result!r}"
+        assert isinstance(bad_result, Exception), "Плохое письмо не должно было записаться"
+
+        stored = db.execute(
+            select(EmailAttachment.sha256).where(EmailAttachment.message_id == good_result[0])
+        ).scalars().all()
+        assert stored == [attachment["sha256"]]
+        assert os.path.exists(get_blob_store().path(attachment["sha256"]))
+    finally:
+        discard_attachments([attachment])
+        db.execute(delete(EmailAttachment).where(EmailAttachment.email_account_id == account.id))
+        db.execute(delete(EmailMessage).where(EmailMessage.email_account_id == account.id))
+        db.execute(delete(EmailAccount).where(EmailAccount.id == account.id))
+        db.commit()
+        db.close()
+        release_blobs([attachment["sha256"]])
+
+
+if __name__ == "__main__":
+    test_bad_message_does_not_break_batch_with_attachments()
+    print("✅ Плохое письмо отклонено, письмо с вложением из того же пакета сохранено")
@@ -4,6 +4,8 @@ const API_URL = 'http://localhost:8000/api/v1';
 let currentEmailAccount = null;
 let wsConnection = null;
 let testData = null;
+let currentMessages = [];
+let lastMessageSeq = 0;
 
 // Инициализация при загрузке popup
 document.addEventListener('DOMContentLoaded', () => {
@@ -173,7 +175,8 @@ function connectWebSocket(emailId) {
         wsConnection.close();
     }
     
-    const wsUrl = `ws://localhost:8000/api/v1/ws/${emailId}`;
+    // Режим push: сервер присылает заголовки нового письма сразу, без повторной загрузки ящика
+    const wsUrl = `ws://localhost:8000/api/v1/ws/${emailId}?mode=push&projection=headers`;
     const status = document.getElementById('emailStatus');
     
     try {
@@ -182,13 +185,23 @@ function connectWebSocket(emailId) {
         wsConnection.onopen = () => {
             status.textContent = 'Подключено';
             status.className = 'status connected';
+            lastMessageSeq = 0;
             loadMessages(); // Загружаем существующие письма
         };
         
         wsConnection.onmessage = (event) => {
             try {
                 const data = JSON.parse(event.data);
-                if (data.type === 'new_message') {
+                if (data.type === 'message') {
+                    // Пропуск номера означает, что часть событий потеряна - перечитываем ящик
+                    if (data.seq === lastMessageSeq + 1) {
+                        currentMessages.unshift(data.message);
+                        displayMessages(currentMessages);
+                    } else {
+                        loadMessages();
+                    }
+                    lastMessageSeq = data.seq;
+                } else if (data.type === 'new_message' || data.type === 'mailbox_changed') {
                     loadMessages(); // Обновляем список при новом письме
                 }
             } catch (e) {
@@ -234,13 +247,14 @@ async function loadMessages() {
     }
     
     try {
-        const response = await fetch(`${API_URL}/email/${currentEmailAccount.id}/messages`);
+        // Для списка нужны только заголовки - тела писем не загружаем
+        const response = await fetch(`${API_URL}/email/${currentEmailAccount.id}/messages?fields=sender,subject,received_at`);
         if (!response.ok) {
             throw new Error('Ошибка загрузки писем');
         }
         
-        const messages = await response.json();
-        displayMessages(messages);
+        currentMessages = await response.json();
+        displayMessages(currentMessages);
     } catch (error) {
         console.error('Ошибка загрузки писем:', error);
         document.getElementById('messagesList').innerHTML = '<div class="loading">Ошибка загрузки</div>';
@@ -323,6 +337,7 @@ function clearAllData() {
     document.getElementById('testDataDisplay').classList.add('hidden');
     document.getElementById('emailDisplay').classList.add('hidden');
     document.getElementById('emailStatus').classList.add('hidden');
+    currentMessages = [];
     document.getElementById('messagesList').innerHTML = '<div class="loading">Нет писем</div>';
     document.getElementById('openSidePanel')?.addEventListener('click', openSidePanel);
 }
@@ -1,11 +1,38 @@
 // sidepanel.js - Панель для просмотра входящих писем
 
 const API_URL = 'http://localhost:8000/api/v1';
+// Поля писем для списка (fields=); body_html - для предпросмотра писем без текстовой части
+const MESSAGE_LIST_FIELDS = 'sender,subject,received_at,body_text,body_html,seq,otp_code,confirm_link';
+
+// Экранирование значения для вставки в HTML разметку (текст и атрибуты)
+function escapeHtml(value) {
+    return String(value)
+        .replace(/&/g, '&amp;')
+        .replace(/</g, '&lt;')
+        .replace(/>/g, '&gt;')
+        .replace(/"/g, '&quot;')
+        .replace(/'/g, '&#39;');
+}
+
+// Ссылка из письма: только http(s), иначе null (javascript:, data: и т.п. не показываем)
+function safeLinkUrl(url) {
+    try {
+        const parsed = new URL(url);
+        return parsed.protocol === 'http:' || parsed.protocol === 'https:' ? parsed.href : null;
+    } catch (error) {
+        return null;
+    }
+}
 
 class SidePanel {
     constructor() {
         this.currentEmailAccount = null;
         this.wsConnection = null;
+        this.messages = [];
+        this.lastMessageSeq = 0;
+        // Водяной знак (seq последнего известного письма) и ETag для инкрементальной синхронизации
+        this.watermark = 0;
+        this.etag = null;
         this.init();
     }
     
@@ -30,10 +57,10 @@ class SidePanel {
             this.loadMessages();
         });
         
-        // Обновляем письма каждые 30 секунд
+        // Проверяем новые письма каждые 30 секунд: если ящик не изменился, сервер отвечает 304
         setInterval(() => {
             if (this.currentEmailAccount) {
-                this.loadMessages();
+                this.syncMessages();
             }
         }, 30000);
     }
@@ -60,14 +87,16 @@ class SidePanel {
         this.showLoading();
         
         try {
-            const response = await fetch(`${API_URL}/email/${this.currentEmailAccount.id}/messages`);
+            const response = await fetch(`${API_URL}/email/${this.currentEmailAccount.id}/messages?fields=${MESSAGE_LIST_FIELDS}`);
             
             if (!response.ok) {
                 throw new Error(`HTTP ${response.status}`);
             }
             
-            const messages = await response.json();
-            this.displayMessages(messages);
+            this.messages = await response.json();
+            this.watermark = Math.max(0, ...this.messages.map(msg => msg.seq || 0));
+            this.etag = null;
+            this.displayMessages(this.messages);
             
         } catch (error) {
             console.error('Ошибка загрузки писем:', error);
@@ -75,6 +104,36 @@ class SidePanel {
         }
     }
     
+    async syncMessages() {
+        try {
+            const headers = this.etag ? { 'If-None-Match': this.etag } : {};
+            const response = await fetch(
+                `${API_URL}/email/${this.currentEmailAccount.id}/messages/since?since=${this.watermark}&fields=${MESSAGE_LIST_FIELDS}`,
+                { headers, cache: 'no-store' }
+            );
+            
+            if (response.status === 304) {
+                return;
+            }
+            if (!response.ok) {
+                throw new Error(`HTTP ${response.status}`);
+            }
+            
+            const newMessages = await response.json();
+            this.etag = response.headers.get('ETag');
+            this.watermark = Number(response.headers.get('X-Watermark')) || this.watermark;
+            
+            const known = new Set(this.messages.map(msg => msg.id));
+            const added = newMessages.filter(msg => !known.has(msg.id));
+            if (added.length > 0) {
+                this.messages = added.reverse().concat(this.messages);
+                this.displayMessages(this.messages);
+            }
+        } catch (error) {
+            console.error('Ошибка синхронизации писем:', error);
+        }
+    }
+    
     displayMessages(messages) {
         const container = document.getElementById('messagesContainer');
         
@@ -112,6 +171,8 @@ class SidePanel {
                 if (msg.body_html.length > 100) preview += '...';
             }
             
+            const confirmLink = msg.confirm_link ? safeLinkUrl(msg.confirm_link) : null;
+            
             return `
                 <div class="message-item">
                     <div class="message-header">
@@ -119,6 +180,8 @@ class SidePanel {
                         <div class="message-time">${timeStr}</div>
                     </div>
                     <div class="message-from">От: ${msg.sender}</div>
+                    ${msg.otp_code ? `<div class="message-code">Код: <strong>${escapeHtml(msg.otp_code)}</strong></div>` : ''}
+                    ${confirmLink ? `<div class="message-code"><a href="${escapeHtml(confirmLink)}" target="_blank" rel="noopener noreferrer">Ссылка подтверждения</a></div>` : ''}
                     ${preview ? `<div class="message-preview">${preview}</div>` : ''}
                     ${msg.has_attachments ? '<div class="attachments">Есть вложения</div>' : ''}
                 </div>
@@ -131,19 +194,32 @@ class SidePanel {
             return;
         }
         
-        const wsUrl = `ws://localhost:8000/api/v1/ws/${this.currentEmailAccount.id}`;
+        // Режим push: сервер присылает письмо с телами для предпросмотра, без повторной загрузки ящика
+        // (projection=full - у писем только с HTML частью текста нет)
+        const wsUrl = `ws://localhost:8000/api/v1/ws/${this.currentEmailAccount.id}?mode=push&projection=full`;
         
         try {
             this.wsConnection = new WebSocket(wsUrl);
             
             this.wsConnection.onopen = () => {
                 console.log('WebSocket подключен для side panel');
+                this.lastMessageSeq = 0;
             };
             
             this.wsConnection.onmessage = (event) => {
                 try {
                     const data = JSON.parse(event.data);
-                    if (data.type === 'new_message') {
+                    if (data.type === 'message') {
+                        // Пропуск номера означает, что часть событий потеряна - перечитываем ящик
+                        if (data.seq === this.lastMessageSeq + 1) {
+                            this.messages.unshift(data.message);
+                            this.watermark = Math.max(this.watermark, data.message.seq || 0);
+                            this.displayMessages(this.messages);
+                        } else {
+                            this.loadMessages();
+                        }
+                        this.lastMessageSeq = data.seq;
+                    } else if (data.type === 'new_message' || data.type === 'mailbox_changed') {
                         // Обновляем список писем при получении нового
                         this.loadMessages();
                     }